@@ -1,28 +1,67 @@
 import os
+import threading
 import duckdb
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-DATABASE_DUCK = os.getenv("DATABASE_DUCK")
+DATABASE_DUCK = os.getenv(
+    "DATABASE_DUCK",
+    os.path.join(os.path.dirname(__file__), "..", "data", "bnb_horizons.duckdb"),
+)
 
+# "postgres" reads gold straight from Postgres, "replica" reads a local DuckDB copy of
+# the active gold version that is refreshed in the background, "embedded" reads every
+# schema from the DATABASE_DUCK file exported by data_processing/export_duckdb.py.
+DATABASE_MODE = os.getenv("DATABASE_MODE", "postgres")
+DUCKDB_REPLICA_PATH = os.getenv("DUCKDB_REPLICA_PATH", "data/gold_replica.duckdb")
+REPLICA_REFRESH_SECONDS = int(os.getenv("REPLICA_REFRESH_SECONDS", 60))
 
-def get_sqlalchemy_session():
-    """Return a new SQLAlchemy session"""
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", os.cpu_count() or 4))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT")
+
+# Memory budget and lifetime of the cached listing search results
+RESULT_CACHE_MB = int(os.getenv("RESULT_CACHE_MB", 256))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 300))
+
+
+def get_sqlalchemy_session(**engine_options):
+    """Return a new SQLAlchemy session, extra options are passed to create_engine"""
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, **engine_options)
     Session = sessionmaker(bind=engine)
 
     return engine, Session()
 
 
+def get_jdbc_options():
+    """Return the Spark JDBC options (url and credentials) for DATABASE_URL"""
+    url = make_url(DATABASE_URL)
+    query = {"reWriteBatchedInserts": "true", "stringtype": "unspecified"}
+    query.update(url.query)
+
+    return {
+        "url": f"jdbc:postgresql://{url.host}:{url.port or 5432}/{url.database}?"
+        + "&".join(f"{key}={value}" for key, value in query.items()),
+        "user": url.username,
+        "password": url.password,
+        "driver": "org.postgresql.Driver",
+    }
+
+
 def get_duckdb_connection():
     """Return the DuckDB connection"""
     con = duckdb.connect()
 
+    if DATABASE_MODE == "embedded":
+        # The local file holds the same schemas, so queries keep their pgdb. names
+        con.execute(f"ATTACH '{DATABASE_DUCK}' AS pgdb (READ_ONLY)")
+        return con
+
     # Install and load the PostgreSQL extension
     con.execute("INSTALL postgres")
     con.execute("LOAD postgres")
@@ -30,3 +69,40 @@ def get_duckdb_connection():
     # Attach the AWS Aurora PostgreSQL database
     con.execute(f"ATTACH '{DATABASE_URL}' AS pgdb (TYPE postgres)")
     return con
+
+
+class DuckDBConnectionManager:
+    """
+    One DuckDB database per process, attached once, with a cursor per thread.
+
+    DuckDB serializes the queries of a single connection, so every thread gets its own
+    cursor. Streamlit runs each script run, not each session, on a new thread, so in
+    the app a cursor lives for one run and is released with its thread. Cursors are
+    cheap and share the database, its attached catalogs and its threads and memory
+    limit settings.
+    """
+
+    def __init__(self, threads=DUCKDB_THREADS, memory_limit=DUCKDB_MEMORY_LIMIT):
+        self.con = get_duckdb_connection()
+        self.con.execute(f"SET threads = {int(threads)}")
+        if memory_limit:
+            self.con.execute(f"SET memory_limit = '{memory_limit}'")
+        self.local = threading.local()
+
+    def cursor(self):
+        """Return the calling thread's cursor"""
+        cursor = getattr(self.local, "cursor", None)
+        if cursor is None:
+            cursor = self.local.cursor = self.con.cursor()
+        return cursor
+
+
+def get_gold_schema(con):
+    """Return the schema of the active gold version, "gold" before the first version"""
+    try:
+        result = con.execute(
+            "SELECT schema_name FROM pgdb.gold.versions WHERE is_active"
+        ).fetchone()
+    except duckdb.CatalogException:
+        return "gold"
+    return result[0] if result else "gold"
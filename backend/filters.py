@@ -0,0 +1,57 @@
+from dataclasses import dataclass, fields
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ListingFilters:
+    """
+    Search filters of the listing pages, a None field is not filtered on.
+    "All" and empty selections are normalized to None, so equal searches compare and
+    hash equal.
+    """
+
+    city_name: Optional[str] = None
+    neighbourhood: Optional[str] = None
+    room_type: Optional[str] = None
+    accommodates: Optional[int] = None
+    nights: Optional[int] = None
+    season: Optional[str] = None
+    price_range: Optional[str] = None
+
+    def __post_init__(self):
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, str):
+                value = value.strip()
+                value = None if value in ("", "All") else value
+            # After the string normalization so "2" and 2 give the same filters
+            if value is not None and field.type == Optional[int]:
+                value = int(value)
+            object.__setattr__(self, field.name, value)
+
+
+def listing_query(table, filters):
+    """
+    Return the parameterized query of a listing search and its named parameters.
+    Filters are always emitted in the same order, so each combination of set filters
+    maps to one fixed query text. The values are bound by DuckDB when the query runs,
+    it is planned on every call and no prepared statement is kept.
+    """
+    conditions, parameters = [], {}
+    for field in fields(filters):
+        value = getattr(filters, field.name)
+        if value is None:
+            continue
+        if field.name == "nights":
+            conditions.append("$nights BETWEEN minimum_nights AND maximum_nights")
+        else:
+            conditions.append(f"{field.name} = ${field.name}")
+        parameters[field.name] = value
+
+    query = f"""
+    SELECT *
+    FROM {table}
+    WHERE {" AND ".join(conditions) or "TRUE"}
+    ORDER BY id DESC
+    """
+    return query, parameters
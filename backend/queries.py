@@ -3,40 +3,124 @@ import os
 
 # Add backend folder to the path
 sys.path.append(os.path.abspath("backend"))
-from db_connection import get_duckdb_connection
+from db_connection import (
+    DuckDBConnectionManager,
+    get_gold_schema,
+    DATABASE_MODE,
+    DUCKDB_REPLICA_PATH,
+    REPLICA_REFRESH_SECONDS,
+    RESULT_CACHE_MB,
+    RESULT_CACHE_TTL,
+)
+from replica import GoldReplica, derived_tables
+from result_cache import ResultCache
+from filters import ListingFilters, listing_query
 
 import streamlit as st
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import shape
-import json
-import scipy.stats as stats
+from shapely import from_wkb
 
 
 @st.cache_resource(show_spinner=False)
 def get_db_connection():
-    con = get_duckdb_connection()
-    return con
+    return DuckDBConnectionManager()
 
 
-con = get_duckdb_connection()
+def cursor():
+    """Return the calling thread's cursor on the process-wide DuckDB connection"""
+    return get_db_connection().cursor()
+
+
+active_gold_schema = None
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def gold_schema():
+    """
+    Resolve the active gold version schema, rechecked every minute so a new version or
+    a rollback is picked up without restarting the app.
+    """
+    global active_gold_schema
+    schema = get_gold_schema(cursor())
+    if schema != active_gold_schema and DATABASE_MODE != "embedded":
+        # The attached catalog is cached, refresh it so the new schema is visible
+        cursor().execute("CALL pg_clear_cache()")
+        active_gold_schema = schema
+    return schema
 
 
 @st.cache_resource(show_spinner=False)
+def get_gold_replica():
+    return GoldReplica(
+        get_db_connection().con, DUCKDB_REPLICA_PATH, REPLICA_REFRESH_SECONDS
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_MB * 1024 * 1024, RESULT_CACHE_TTL)
+
+
+def cached_listing_query(table, filters):
+    """
+    Run a listing search through the result cache. The key holds the resolved table,
+    so a replica still copying the new version keeps its own entries. Every search logs
+    the cache's hit and miss counts.
+    """
+    query, parameters = listing_query(gold_table(table), filters)
+    cache = get_result_cache()
+    data = cache.get_or_run(
+        (query, filters),
+        gold_schema(),
+        lambda: cursor().execute(query, parameters).fetchdf(),
+    )
+
+    stats = cache.stats()
+    print(
+        f"Result cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%}), {stats['entries']} entries, "
+        f"{stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f} MB"
+    )
+    return data
+
+
+def gold_table(name):
+    """
+    Return the qualified name of a table in the active gold version, from the local
+    replica in replica mode.
+    """
+    if DATABASE_MODE == "replica":
+        return get_gold_replica().table(name)
+    return f"pgdb.{gold_schema()}.{name}"
+
+
+def silver_table(name):
+    """
+    Return the qualified name of a silver table, or a subquery for the filter values
+    derived from silver.listings, from the local replica in replica mode.
+    """
+    if DATABASE_MODE == "replica":
+        return get_gold_replica().table(name)
+    if name in derived_tables:
+        return f"({derived_tables[name]})"
+    return f"pgdb.silver.{name}"
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_filters():
     """
     Retrieve unique accommodates and room types from the database.
     """
-    query = """
+    query = f"""
         SELECT
-            array_agg(DISTINCT l.accommodates) AS unique_accommodates,
-            array_agg(DISTINCT r.room_type) AS unique_room_types
-        FROM pgdb.silver.listings l
-        LEFT JOIN pgdb.silver.room_types r ON l.room_type_id = r.room_type_id
+            array_agg(DISTINCT accommodates) AS unique_accommodates,
+            array_agg(DISTINCT room_type) AS unique_room_types
+        FROM {silver_table('listing_filters')}
     """
 
-    result = con.execute(query).fetchone()
+    result = cursor().execute(query).fetchone()
 
     unique_accommodates = result[0] if result[0] else []
     unique_room_types = result[1] if result[1] else []
@@ -44,159 +128,200 @@ def get_filters():
     return unique_accommodates, unique_room_types
 
 
-@st.cache_resource(show_spinner=False)
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_cities():
     """
     Retrieve city names from the database.
     """
     return sorted(
         row[0]
-        for row in con.execute(
-            "SELECT DISTINCT city_name FROM pgdb.silver.city"
-        ).fetchall()
+        for row in cursor()
+        .execute(f"SELECT DISTINCT city_name FROM {silver_table('city')}")
+        .fetchall()
     )
 
 
-@st.cache_resource(show_spinner=False)
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_room_types():
     """
     Retrieve room types from the database.
     """
     return sorted(
         row[0]
-        for row in con.execute(
-            "SELECT DISTINCT room_type FROM pgdb.silver.room_types"
-        ).fetchall()
+        for row in cursor()
+        .execute(f"SELECT DISTINCT room_type FROM {silver_table('room_types')}")
+        .fetchall()
     )
 
 
-@st.cache_resource(show_spinner=False)
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
 def get_neighbourhoods(city):
     """
     Retrieve neighbourhood names and IDs for the given city.
     """
     if city:
-        return con.execute(
-            """
+        return (
+            cursor()
+            .execute(
+                f"""
             SELECT DISTINCT n.neighbourhood, n.neighbourhood_id
-            FROM pgdb.silver.neighbourhoods n
-            JOIN pgdb.silver.city c ON n.city_id = c.city_id
+            FROM {silver_table('neighbourhoods')} n
+            JOIN {silver_table('city')} c ON n.city_id = c.city_id
             WHERE c.city_name = ?
             """,
-            [city],
-        ).fetchall()
+                [city],
+            )
+            .fetchall()
+        )
     return []
 
 
-def get_loc(city, neighbourhood, city_centers):
+@st.cache_data(ttl=60, show_spinner=False)
+def get_loc(city, neighbourhood):
     """
     Get the average latitude and longitude of the neighbourhood and the distance to the city center.
     """
-    query = """
-        SELECT AVG(latitude) AS latitude, AVG(longitude) AS longitude
-        FROM pgdb.gold.earnings_summary
+    query = f"""
+        SELECT latitude, longitude, distance_to_center
+        FROM {gold_table('neighbourhood_geo')}
         WHERE city_name = ? AND neighbourhood = ?"""
 
-    params = [city, neighbourhood]
-    result = con.execute(query, params).fetchone()
+    result = cursor().execute(query, [city, neighbourhood]).fetchone()
+    return tuple(result) if result else (np.nan, np.nan, np.nan)
 
-    avg_lat, avg_lon = result[0], result[1]
-    city_center = city_centers.get(city, {"latitude": 0, "longitude": 0})
-    distance_to_center = np.sqrt(
-        (avg_lat - city_center["latitude"]) ** 2
-        + (avg_lon - city_center["longitude"]) ** 2
-    )
-    return avg_lat, avg_lon, distance_to_center
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_map_center(city, neighbourhood=None):
+    """
+    Get the map center of a city, or the polygon centroid of one of its neighbourhoods.
+    A city without a known center falls back to the mean of its neighbourhood centroids,
+    and None is returned when there is no location at all.
+    """
+    if neighbourhood:
+        latitude = "any_value(centroid_latitude)"
+        longitude = "any_value(centroid_longitude)"
+    else:
+        latitude = "COALESCE(any_value(center_latitude), avg(centroid_latitude))"
+        longitude = "COALESCE(any_value(center_longitude), avg(centroid_longitude))"
+    query = f"""
+        SELECT {latitude}, {longitude}
+        FROM {gold_table('neighbourhood_geo')}
+        WHERE city_name = ? {"AND neighbourhood = ?" if neighbourhood else ""}"""
+
+    params = [city, neighbourhood] if neighbourhood else [city]
+    center = cursor().execute(query, params).fetchone()
+    if center is None or None in center:
+        return None
+    return list(center)
 
 
 @st.cache_data(show_spinner=False)
-def geometry_query():
+def geometry_query(city=None, tolerance=0.01):
     """
-    Query the database and return neighbourhoods with geometry as proper JSON.
+    Query the database and return neighbourhoods with simplified shapely geometries.
+    The simplification runs in PostGIS and geometries are transferred as WKB, the
+    embedded database and the replica store them already simplified with the default
+    tolerance.
     """
-    query = """
-    SELECT 
-        n.neighbourhood_id,
-        n.neighbourhood, 
-        n.geometry
-    FROM pgdb.silver.neighbourhoods n;
+    if DATABASE_MODE in ("embedded", "replica"):
+        source = f"""
+        SELECT n.neighbourhood_id, n.neighbourhood, c.city_name, n.geometry
+        FROM {silver_table('neighbourhoods')} n
+        JOIN {silver_table('city')} c ON n.city_id = c.city_id
+        """
+    else:
+        # postgres_query is opaque to DuckDB, so the city filter is part of the Postgres
+        # SQL, its quotes escaped once for Postgres and once for the DuckDB string
+        city_filter = ""
+        if city:
+            city_filter = "WHERE c.city_name = '" + city.replace("'", "''") + "'"
+        postgres_sql = f"""
+            SELECT
+                n.neighbourhood_id,
+                n.neighbourhood,
+                c.city_name,
+                ST_AsBinary(
+                    ST_Transform(
+                        ST_SimplifyPreserveTopology(ST_Transform(n.geometry, 3857), {float(tolerance)}),
+                        4326
+                    )
+                ) AS geometry
+            FROM silver.neighbourhoods n
+            JOIN silver.city c ON n.city_id = c.city_id
+            {city_filter}
+        """
+        source = f"""
+        SELECT * FROM postgres_query('pgdb', '{postgres_sql.replace("'", "''")}')
+        """
+
+    query = f"""
+    SELECT neighbourhood_id, neighbourhood, city_name, geometry
+    FROM ({source})
+    {"WHERE city_name = ?" if city else ""}
     """
     try:
-        data = con.execute(query).fetchdf()
-        data["geometry"] = data["geometry"].apply(
-            lambda x: shape(json.loads(x.strip('"').replace('\\"', '"')))
-        )
-        return data
+        data = cursor().execute(query, [city] if city else []).fetchdf()
+        # DuckDB returns BLOBs as bytearray, which from_wkb does not accept
+        data["geometry"] = from_wkb([bytes(g) for g in data["geometry"]])
+        return data.drop(columns="city_name")
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return pd.DataFrame()
 
 
-df = geometry_query()
+def data_query(filters):
+    """
+    Query the DuckDB database and return the listings matching the ListingFilters.
+    """
+    try:
+        return cached_listing_query("listings_aggregated", filters)
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return pd.DataFrame()
 
 
-def data_query(where_clause):
+def neigh_price_query(selected_neighbourhood):
     """
-    Query the DuckDB database and return filtered data based on user input.
+    Look up the precomputed price statistics of the selected neighbourhood: average
+    accommodates, bedrooms and bathrooms, the 95% CI of the price and the box plot stats.
     """
     query = f"""
     SELECT *
-    FROM pgdb.gold.listings_aggregated l
-    WHERE {where_clause}
-    ORDER BY id DESC;
+    FROM {gold_table('neighbourhood_stats')}
+    WHERE neighbourhood = ?
     """
     try:
-        data = con.execute(query).fetchdf()
-        data["seasonal_prices"] = data["seasonal_prices"].apply(
-            lambda x: x.strip('"').replace('\\"', '"') if pd.notna(x) else x
+        data = cursor().execute(query, [selected_neighbourhood]).fetchdf()
+        if data.empty:
+            data = pd.DataFrame(np.nan, index=[0], columns=data.columns)
+        data = data.iloc[0]
+
+        return (
+            data["avg_accommodates"],
+            data["avg_bedrooms"],
+            data["avg_bathrooms"],
+            data["lower_bound"],
+            data["upper_bound"],
+            data,
         )
-        return data
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return pd.DataFrame()
 
 
-def neigh_price_query(selected_neighbourhood):
+@st.cache_data(ttl=60, show_spinner=False)
+def neighbourhood_trends_query(neighbourhood_id):
     """
-    Query the data of neighbourhoods and return the average price, accommodates, bedrooms, bathrooms, and the data of the selected neighbourhood.
+    Query the quarter over quarter price, rating and occupancy trends of a neighbourhood.
     """
     query = f"""
-    SELECT 
-        l.neighbourhood,
-        l.price_float,
-        l.accommodates,
-        l.bedrooms,
-        l.bathrooms
-    FROM pgdb.gold.earnings_summary l
-    WHERE l.neighbourhood = '{selected_neighbourhood}'
+    SELECT *
+    FROM {gold_table('neighbourhood_trends')}
+    WHERE neighbourhood_id = ?
+    ORDER BY room_type, date_id
     """
     try:
-        data = con.execute(query).fetchdf()
-        avg_accommodates = data["accommodates"].mean()
-        avg_bedrooms = data["bedrooms"].mean()
-        avg_bathrooms = data["bathrooms"].mean()
-        mean_price = data["price_float"].mean()
-        std_dev = data["price_float"].std()
-        n = len(data)
-        if n > 1 and std_dev > 0:
-            if n > 30:
-                critical_value = stats.norm.ppf(0.975)
-            else:
-                critical_value = stats.t.ppf(0.975, n - 1)
-            margin_of_error = critical_value * std_dev / np.sqrt(n)
-            lower_bound = mean_price - margin_of_error
-            upper_bound = mean_price + margin_of_error
-        else:
-            lower_bound, upper_bound = mean_price
-
-        return (
-            avg_accommodates,
-            avg_bedrooms,
-            avg_bathrooms,
-            lower_bound,
-            upper_bound,
-            data,
-        )
+        return cursor().execute(query, [neighbourhood_id]).fetchdf()
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return pd.DataFrame()
@@ -205,7 +330,7 @@ def neigh_price_query(selected_neighbourhood):
 st.cache_data(show_spinner=False)
 
 
-@st.cache_resource(show_spinner=False)
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_seasons():
     """
     Get the seasons from the database and sort them in a specific order.
@@ -219,15 +344,15 @@ def get_seasons():
 
     seasons = [
         row[0]
-        for row in con.execute(
-            "SELECT DISTINCT season FROM pgdb.silver.listings"
-        ).fetchall()
+        for row in cursor()
+        .execute(f"SELECT DISTINCT season FROM {silver_table('seasons')}")
+        .fetchall()
     ]
 
     return sorted(seasons, key=lambda season: place_order.get(season, float("inf")))
 
 
-@st.cache_resource(show_spinner=False)
+@st.cache_data(ttl=60, show_spinner=False)
 def price_ranges():
     """
     Get the price ranges from the database and sort them in a specific order.
@@ -242,31 +367,123 @@ def price_ranges():
     }
     price_range = [
         row[0]
-        for row in con.execute(
-            "SELECT DISTINCT price_range FROM pgdb.gold.reccomendations_summary"
-        ).fetchall()
+        for row in cursor()
+        .execute(
+            f"SELECT DISTINCT price_range FROM {gold_table('reccomendations_summary')}"
+        )
+        .fetchall()
     ]
 
     return sorted(price_range, key=lambda price: price_order.get(price, float("inf")))
 
 
-def reccomendation_query(where_clause):
+def reccomendation_query(filters):
+    """
+    Query the DuckDB database and return the listings matching the ListingFilters.
+    """
+    try:
+        return cached_listing_query("reccomendations_summary", filters)
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return pd.DataFrame()
+
+
+@st.cache_data(show_spinner=False)
+def get_texts(text_hashes):
+    """
+    Resolve content hashes to their text using the deduplicated texts table.
+    """
+    text_hashes = [h for h in text_hashes if h and h != "None"]
+    if not text_hashes:
+        return {}
+
+    placeholders = ", ".join("?" for _ in text_hashes)
+    query = f"""
+    SELECT CAST(text_hash AS VARCHAR), content
+    FROM {silver_table('texts')}
+    WHERE text_hash IN ({placeholders})
+    """
+    try:
+        return dict(cursor().execute(query, text_hashes).fetchall())
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return {}
+
+
+@st.cache_data(show_spinner=False)
+def get_listing_amenities(listing_id):
     """
-    Query the DuckDB database and return filtered data based on user input.
+    Return the amenities of a listing grouped by category, from its latest quarter.
     """
     query = f"""
-    SELECT *
-    FROM pgdb.gold.reccomendations_summary
-    WHERE {where_clause}
-    ORDER BY id DESC;
+    SELECT a.category, list(a.amenity ORDER BY a.amenity) AS amenities
+    FROM {silver_table('listing_amenities')} la
+    JOIN {silver_table('amenities')} a ON la.amenity_id = a.amenity_id
+    WHERE la.listing_id = ?
+        AND la.date_id = (
+            SELECT max(date_id)
+            FROM {silver_table('listing_amenities')}
+            WHERE listing_id = ?
+        )
+    GROUP BY a.category
+    ORDER BY a.category
     """
     try:
-        data = con.execute(query).fetchdf()
-        data["categorized_amenities"] = data["categorized_amenities"].apply(
-            lambda x: json.loads(x) if isinstance(x, str) else x
+        return dict(cursor().execute(query, [listing_id, listing_id]).fetchall())
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return {}
+
+
+# The dimensions of each filter cube, in the order of their GROUPING bits
+cube_dimensions = {
+    "filter_cube": [
+        "neighbourhood",
+        "room_type",
+        "accommodates",
+        "season",
+        "price_range",
+    ],
+    "listings_cube": ["neighbourhood", "room_type", "accommodates"],
+}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def filter_counts(
+    city, filters, facet=None, count="listing_seasons", cube="filter_cube"
+):
+    """
+    Count the results of the selected filters from a precomputed filter cube.
+    `filters` is a tuple of (dimension, value) pairs, None values are not filtered.
+    With a facet, return the count of every value of that dimension instead. The cubes
+    do not know about nights, so a count is the most a search can return.
+    """
+    filters = {
+        dimension: value
+        for dimension, value in filters
+        if value is not None and dimension != facet
+    }
+    grouped = set(filters) | {facet}
+    dimensions = cube_dimensions[cube]
+    grouping_set = sum(
+        1 << (len(dimensions) - 1 - i)
+        for i, dimension in enumerate(dimensions)
+        if dimension not in grouped
+    )
+    where = "".join(f" AND {dimension} = ?" for dimension in filters)
+    query = f"""
+    SELECT {facet or "NULL"}, {count}
+    FROM {gold_table(cube)}
+    WHERE city_name = ? AND grouping_set = ?{where}
+    """
+    try:
+        rows = (
+            cursor().execute(query, [city, grouping_set, *filters.values()]).fetchall()
         )
-
-        return data
     except Exception as e:
         st.error(f"An error occurred: {e}")
-        return pd.DataFrame()
+        return {} if facet else None
+
+    if facet:
+        return dict(rows)
+    return rows[0][1] if rows else 0
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+from db_connection import get_gold_schema
+
+gold_tables = [
+    "listings_aggregated",
+    "earnings_summary",
+    "reccomendations_summary",
+    "neighbourhood_stats",
+    "neighbourhood_geo",
+    "filter_cube",
+    "listings_cube",
+    "neighbourhood_trends",
+]
+
+# Silver tables read by the app, copied next to the gold tables of each version since
+# silver is reloaded before every gold build. neighbourhoods keeps its geometries
+# simplified to WKB, like the embedded export, and silver.listings is too large to
+# copy so only the filter values read from it are.
+silver_tables = {
+    "city": "SELECT * FROM pgdb.silver.city",
+    "room_types": "SELECT * FROM pgdb.silver.room_types",
+    "texts": "SELECT * FROM pgdb.silver.texts",
+    "amenities": "SELECT * FROM pgdb.silver.amenities",
+    "listing_amenities": "SELECT * FROM pgdb.silver.listing_amenities",
+    "neighbourhoods": """
+    SELECT * FROM postgres_query('pgdb', '
+        SELECT
+            neighbourhood_id,
+            neighbourhood,
+            neighbourhood_group,
+            city_id,
+            ST_AsBinary(
+                ST_Transform(
+                    ST_SimplifyPreserveTopology(ST_Transform(geometry, 3857), 0.01),
+                    4326
+                )
+            ) AS geometry,
+            centroid_latitude,
+            centroid_longitude,
+            min_latitude,
+            min_longitude,
+            max_latitude,
+            max_longitude
+        FROM silver.neighbourhoods
+    ')
+    """,
+}
+derived_tables = {
+    "seasons": "SELECT DISTINCT season FROM pgdb.silver.listings",
+    "listing_filters": """
+    SELECT DISTINCT l.accommodates, r.room_type
+    FROM pgdb.silver.listings l
+    LEFT JOIN pgdb.silver.room_types r ON l.room_type_id = r.room_type_id
+    """,
+}
+
+
+class GoldReplica:
+    """
+    Local DuckDB copy of the active gold version, attached as `replica`.
+
+    The gold tables, and the silver tables the app reads, are copied from the attached
+    Postgres database into a schema named after their version. A background thread copies the next version as soon as it is
+    activated, and reads keep using the previous copy until the new one is complete.
+    """
+
+    def __init__(self, con, path, refresh_seconds=60):
+        self.con = con
+        self.refresh_seconds = refresh_seconds
+        self.schema = None
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        con.execute(f"ATTACH '{path}' AS replica")
+
+        self.refresh()
+        threading.Thread(target=self.refresh_loop, daemon=True).start()
+
+    def table(self, name):
+        """Return the qualified name of a gold table in the local copy"""
+        with self.lock:
+            return f"replica.{self.schema}.{name}"
+
+    def refresh(self):
+        """
+        Copy the active gold version if the local copy is behind, and drop the copies
+        older than the one it replaces
+        """
+        cursor = self.con.cursor()
+        schema = get_gold_schema(cursor)
+        previous = None
+        if schema != self.schema:
+            if not self.has_version(cursor, schema):
+                start = time.perf_counter()
+                cursor.execute("CALL pg_clear_cache()")
+                cursor.execute(f"DROP SCHEMA IF EXISTS replica.{schema} CASCADE")
+                cursor.execute(f"CREATE SCHEMA replica.{schema}")
+                for table in self.source_tables(cursor, schema):
+                    cursor.execute(
+                        f"""
+                        CREATE TABLE replica.{schema}.{table} AS
+                        SELECT * FROM pgdb.{schema}.{table}
+                        """
+                    )
+                for table, query in {**silver_tables, **derived_tables}.items():
+                    cursor.execute(f"CREATE TABLE replica.{schema}.{table} AS {query}")
+                cursor.execute(
+                    f"CREATE TABLE replica.{schema}.replica_complete AS SELECT now() AS copied_at"
+                )
+                print(f"{schema} replicated in {time.perf_counter() - start:.1f}s")
+
+            with self.lock:
+                previous, self.schema = self.schema, schema
+
+        # The copy just replaced stays until the next refresh, for the reads that
+        # resolved its table names before the switch
+        keep = {"main", "information_schema", "pg_catalog", schema, previous}
+        for (stale,) in cursor.execute(
+            """
+            SELECT schema_name
+            FROM duckdb_schemas()
+            WHERE database_name = 'replica'
+            """
+        ).fetchall():
+            if stale not in keep:
+                cursor.execute(f"DROP SCHEMA replica.{stale} CASCADE")
+
+    def refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing the gold replica: {e}")
+
+    @staticmethod
+    def has_version(cursor, schema):
+        """
+        Whether a previous run already copied this version completely, copies made
+        before the silver tables were replicated are copied again
+        """
+        expected = {"replica_complete", *silver_tables, *derived_tables}
+        copied = {
+            row[0]
+            for row in cursor.execute(
+                """
+                SELECT table_name
+                FROM duckdb_tables()
+                WHERE database_name = 'replica' AND schema_name = ?
+                """,
+                [schema],
+            ).fetchall()
+        }
+        return expected <= copied
+
+    @staticmethod
+    def source_tables(cursor, schema):
+        """The gold tables present in the Postgres version, older ones may lack some"""
+        existing = {
+            row[0]
+            for row in cursor.execute(
+                """
+                SELECT table_name
+                FROM duckdb_tables()
+                WHERE database_name = 'pgdb' AND schema_name = ?
+                """,
+                [schema],
+            ).fetchall()
+        }
+        return [table for table in gold_tables if table in existing]
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Process-wide LRU cache of query results, bounded by their size in bytes.
+
+    Entries expire after `ttl` seconds and the whole cache is dropped when the gold
+    version changes. Results are shared between sessions, so callers get a copy they
+    are free to modify.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_run(self, key, version, run):
+        """Return the cached DataFrame of `key`, running `run` on a miss"""
+        with self.lock:
+            if version != self.version:
+                self.clear()
+                self.version = version
+
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0].copy()
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+
+        # Run outside the lock so a slow query does not block other sessions
+        data = run()
+        size = int(data.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return data
+
+        with self.lock:
+            if version != self.version:
+                return data
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (data, size, time.monotonic())
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+        return data.copy()
+
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """Hit and miss counts and the current size of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import duckdb
+
+sys.path.append("..")
+from backend.db_connection import DATABASE_URL, DATABASE_DUCK
+
+# Silver tables read by the app, neighbourhoods is exported separately with its
+# geometries simplified and converted to WKB since DuckDB has no PostGIS.
+silver_tables = [
+    "city",
+    "room_types",
+    "property_types",
+    "dates",
+    "listings",
+    "texts",
+    "amenities",
+    "listing_amenities",
+]
+gold_tables = [
+    "listings_aggregated",
+    "earnings_summary",
+    "reccomendations_summary",
+    "neighbourhood_stats",
+    "neighbourhood_geo",
+    "filter_cube",
+    "listings_cube",
+    "neighbourhood_trends",
+]
+
+# Build next to the target and swap it in at the end, a running app keeps its file
+path = os.path.abspath(DATABASE_DUCK)
+building = f"{path}.building"
+if os.path.exists(building):
+    os.remove(building)
+os.makedirs(os.path.dirname(path), exist_ok=True)
+
+start = time.perf_counter()
+con = duckdb.connect(building)
+con.execute("INSTALL postgres")
+con.execute("LOAD postgres")
+con.execute(f"ATTACH '{DATABASE_URL}' AS pg (TYPE postgres, READ_ONLY)")
+
+con.execute("CREATE SCHEMA silver")
+for table in silver_tables:
+    con.execute(f"CREATE TABLE silver.{table} AS SELECT * FROM pg.silver.{table}")
+    print(f"silver.{table} exported successfully!")
+
+con.execute(
+    """
+    CREATE TABLE silver.neighbourhoods AS
+    SELECT * FROM postgres_query('pg', '
+        SELECT
+            neighbourhood_id,
+            neighbourhood,
+            neighbourhood_group,
+            city_id,
+            ST_AsBinary(
+                ST_Transform(
+                    ST_SimplifyPreserveTopology(ST_Transform(geometry, 3857), 0.01),
+                    4326
+                )
+            ) AS geometry,
+            centroid_latitude,
+            centroid_longitude,
+            min_latitude,
+            min_longitude,
+            max_latitude,
+            max_longitude
+        FROM silver.neighbourhoods
+    ')
+    """
+)
+print("silver.neighbourhoods exported successfully!")
+
+schema = con.execute(
+    "SELECT schema_name FROM pg.gold.versions WHERE is_active"
+).fetchone()[0]
+con.execute(f"CREATE SCHEMA {schema}")
+for table in gold_tables:
+    con.execute(f"CREATE TABLE {schema}.{table} AS SELECT * FROM pg.{schema}.{table}")
+    print(f"{schema}.{table} exported successfully!")
+
+# Only the exported version, so the app resolves it like it does on Postgres
+con.execute("CREATE SCHEMA gold")
+con.execute(
+    """
+    CREATE TABLE gold.versions AS
+    SELECT * FROM pg.gold.versions WHERE is_active
+    """
+)
+
+con.execute("DETACH pg")
+con.close()
+os.replace(building, path)
+print(f"{path} exported in {time.perf_counter() - start:.1f}s")
@@ -1,470 +1,850 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, VARCHAR, INTEGER, BIGINT, FLOAT, text, JSON
-from sqlalchemy.dialects.postgresql import JSONB
-import pandas as pd
-import numpy as np
-import json
+from sqlalchemy import text
+import scipy.stats as stats
+import os
 import sys
 
 sys.path.append("../..")
 from backend.db_connection import get_sqlalchemy_session
+from data_processing.scheduler import run_tasks
+from data_processing.gold.versions import (
+    create_versions_table,
+    get_active_version,
+    get_next_version,
+    get_recommended_indexes,
+    register_version,
+    activate_version,
+    prune_versions,
+)
+
+max_workers = int(os.getenv("GOLD_BUILD_WORKERS", 3))
+engine, session = get_sqlalchemy_session(pool_size=max_workers, max_overflow=0)
+
+# Every run builds a new gold_v{n} schema next to the active one and switches the app
+# to it at the end, the previous version is kept for rollbacks (see rollback.py).
+create_versions_table(engine)
+active = get_active_version(engine)
+active_schema = active.schema_name if active else None
+version = get_next_version(engine)
+schema = f"gold_v{version}"
+keep_versions = int(os.getenv("GOLD_KEEP_VERSIONS", 1))
+
+# "full" rebuilds every gold table, "incremental" copies the active version and
+# recomputes only the listings whose silver rows changed, "auto" picks incremental
+# once an active version exists.
+refresh_mode = os.getenv("GOLD_REFRESH_MODE", "auto")
+if refresh_mode == "auto":
+    refresh_mode = "incremental" if active_schema else "full"
+incremental = refresh_mode == "incremental"
+
+changed_listings = "id IN (SELECT id FROM gold.stg_changed_ids)"
+
+with engine.begin() as conn:
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {schema}"))
+
+
+def listings_wide():
+    """
+    Build the silver listings join shared by every gold table once, as an unlogged
+    staging table indexed on the listing id.
+    """
+    query = """
+    DROP TABLE IF EXISTS gold.stg_listings_wide;
 
-engine, session = get_sqlalchemy_session()
-
+    CREATE UNLOGGED TABLE gold.stg_listings_wide AS
+    SELECT
+        l.id,
+        l.date_id,
+        l.season,
+        n.neighbourhood_id,
+        n.neighbourhood,
+        c.city_name,
+        p.property_type,
+        r.room_type,
+        l.accommodates,
+        l.bedrooms,
+        l.bathrooms,
+        l.minimum_nights,
+        l.maximum_nights,
+        l.name_hash,
+        l.description_hash,
+        l.listing_url_hash,
+        l.picture_url_hash,
+        l.latitude,
+        l.longitude,
+        l.review_missing,
+        l.review_scores_rating,
+        l.price_float,
+        h.host_name,
+        ha.host_about_hash,
+        ha.host_picture_url,
+        ha.host_is_superhost,
+        ha.host_identity_verified,
+        ha.host_response_time
+    FROM silver.listings l
+    LEFT JOIN silver.property_types p ON l.property_id = p.property_id
+    LEFT JOIN silver.room_types r ON l.room_type_id = r.room_type_id
+    LEFT JOIN silver.city c ON l.city_id = c.city_id
+    LEFT JOIN silver.neighbourhoods n ON l.neighbourhood_id = n.neighbourhood_id
+    LEFT JOIN silver.host_details h ON l.host_id = h.host_id
+    LEFT JOIN silver.host_activity AS ha
+        ON l.host_id = ha.host_id
+        AND l.date_id = ha.date_id
+        AND l.id = ha.listing_id;
 
-def listings_aggregated():
-    query = """
-        SELECT 
-            l.id, 
-            l.date_id,
-            l.season,
-            n.neighbourhood_id,
-            n.neighbourhood, 
-            c.city_name,
-            p.property_type,
-            r.room_type, 
-            l.accommodates,
-            l.bedrooms,
-            l.bathrooms,
-            l.minimum_nights, 
-            l.maximum_nights, 
-            l.listing_url,
-            l.picture_url,
-            l.latitude,
-            l.longitude,
-            l.review_missing,
-            l.review_scores_rating, 
-            l.categorized_amenities,
-            l.price_float
-        FROM silver.listings l
-        LEFT JOIN silver.property_types p ON l.property_id = p.property_id
-        LEFT JOIN silver.room_types r ON l.room_type_id = r.room_type_id
-        LEFT JOIN silver.city c ON l.city_id = c.city_id
-        LEFT JOIN silver.neighbourhoods n ON l.neighbourhood_id = n.neighbourhood_id
-        """
-    listings_df = pd.read_sql(query, engine)
+    CREATE INDEX idx_stg_listings_wide_id ON gold.stg_listings_wide (id, date_id);
+    ANALYZE gold.stg_listings_wide;
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
 
-    listings_df["categorized_amenities"] = listings_df["categorized_amenities"].replace(
-        "null", np.nan
-    )
+    print("stg_listings_wide created successfully!")
 
-    listings_df = listings_df.sort_values(by="date_id", ascending=False)
 
-    picture_url = listings_df.groupby("id")["picture_url"].last().reset_index()
-    categories = listings_df.groupby("id")["categorized_amenities"].last().reset_index()
-    neighbourhoods = (
-        listings_df.groupby("id")[["neighbourhood_id", "neighbourhood"]]
-        .last()
-        .reset_index()
+def listing_changes():
+    """
+    Fingerprint every listing from its staged silver rows and calendar rows, and keep
+    the ids whose fingerprint differs from the active version in gold.stg_changed_ids.
+    New and removed listings count as changed, a full refresh marks every listing.
+    """
+    previous = (
+        f"{active_schema}.listing_fingerprints"
+        if incremental
+        else "(SELECT NULL::BIGINT AS id, NULL::UUID AS fingerprint)"
     )
-    property_types = listings_df.groupby("id")["property_type"].last().reset_index()
-    room_types = listings_df.groupby("id")["room_type"].last().reset_index()
-
-    seasonal_prices = (
-        listings_df.groupby("id")
-        .apply(lambda x: json.dumps(dict(zip(x["season"], x["price_float"]))))
-        .reset_index(name="seasonal_prices")
+    query = f"""
+    DROP TABLE IF EXISTS gold.stg_fingerprints;
+
+    CREATE UNLOGGED TABLE gold.stg_fingerprints AS
+    WITH listing AS (
+        SELECT id, md5(string_agg(w::text, '|' ORDER BY w.date_id)) AS fingerprint
+        FROM gold.stg_listings_wide w
+        GROUP BY id
+    ),
+    calendar AS (
+        SELECT id, md5(string_agg(c::text, '|' ORDER BY c::text)) AS fingerprint
+        FROM silver.calendar c
+        WHERE id IN (SELECT id FROM listing)
+        GROUP BY id
     )
+    SELECT
+        l.id,
+        md5(l.fingerprint || COALESCE(c.fingerprint, ''))::uuid AS fingerprint
+    FROM listing l
+    LEFT JOIN calendar c ON l.id = c.id;
 
-    final_df = (
-        picture_url.merge(categories, on="id", how="left")
-        .merge(neighbourhoods, on="id", how="left")
-        .merge(property_types, on="id", how="left")
-        .merge(room_types, on="id", how="left")
-        .merge(seasonal_prices, on="id", how="left")
-    )
+    DROP TABLE IF EXISTS gold.stg_changed_ids;
 
-    grouped_listings = (
-        listings_df.groupby("id")
-        .agg(
-            {
-                "city_name": "last",
-                "listing_url": "last",
-                "accommodates": "mean",
-                "bedrooms": "mean",
-                "bathrooms": "mean",
-                "minimum_nights": "mean",
-                "maximum_nights": "mean",
-                "latitude": "mean",
-                "longitude": "mean",
-                "review_missing": "mean",
-                "review_scores_rating": "mean",
-                "price_float": "mean",
-            }
-        )
-        .reset_index()
-    )
+    CREATE UNLOGGED TABLE gold.stg_changed_ids AS
+    SELECT COALESCE(n.id, o.id) AS id
+    FROM gold.stg_fingerprints n
+    FULL JOIN {previous} o ON n.id = o.id
+    WHERE n.fingerprint IS DISTINCT FROM o.fingerprint
+        AND COALESCE(n.id, o.id) IS NOT NULL;
+
+    ALTER TABLE gold.stg_changed_ids ADD PRIMARY KEY (id);
+    ANALYZE gold.stg_changed_ids;
+
+    CREATE TABLE {schema}.listing_fingerprints AS
+    SELECT id, fingerprint, now() AS refreshed_at
+    FROM gold.stg_fingerprints;
 
-    columns_to_round = [
-        "review_missing",
-        "accommodates",
-        "bedrooms",
-        "bathrooms",
-        "minimum_nights",
-        "maximum_nights",
+    ALTER TABLE {schema}.listing_fingerprints
+    ADD CONSTRAINT pk_listing_fingerprints PRIMARY KEY (id);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
+        changed = conn.execute(text("SELECT count(*) FROM gold.stg_changed_ids"))
+
+    print(f"{changed.scalar()} changed listings found, refresh mode: {refresh_mode}")
+
+
+# Categorical gold columns stored as Postgres enums of the new version. Columns without
+# a fixed label order are labelled with their staged values in alphabetical order.
+enum_columns = {
+    "city_name": None,
+    "neighbourhood": None,
+    "property_type": None,
+    "room_type": None,
+    "host_response_time": None,
+    "season": ["Early Spring", "Early Summer", "Early Autumn", "Early Winter"],
+    "price_range": [
+        "Extremely Cheap (<$20)",
+        "Very Cheap ($20-$50)",
+        "Cheap ($50-$100)",
+        "Moderate ($100-$200)",
+        "Expensive ($200-$300)",
+        "Very Expensive (>$300)",
+    ],
+}
+enum_types = {}
+
+
+def create_enum_types():
+    """
+    Create one enum type per categorical column in the new version's schema. Enums are
+    stored as 4 byte codes and compared without collation, while still reading and
+    filtering as their text labels.
+    """
+    with engine.begin() as conn:
+        for column, labels in enum_columns.items():
+            if labels is None:
+                labels = (
+                    conn.execute(
+                        text(
+                            f"""
+                            SELECT DISTINCT {column}
+                            FROM gold.stg_listings_wide
+                            WHERE {column} IS NOT NULL
+                            ORDER BY {column}
+                            """
+                        )
+                    )
+                    .scalars()
+                    .all()
+                )
+            # Postgres enum labels are limited to 63 bytes
+            if any(len(label.encode()) > 63 for label in labels):
+                print(f"{column} has labels over 63 bytes, keeping it as text")
+                continue
+
+            parameters = {f"label_{i}": label for i, label in enumerate(labels)}
+            placeholders = ", ".join(f":{name}" for name in parameters)
+            conn.execute(
+                text(f"CREATE TYPE {schema}.{column} AS ENUM ({placeholders})"),
+                parameters,
+            )
+            enum_types[column] = f"{schema}.{column}"
+
+    print(f"{len(enum_types)} enum types created successfully!")
+
+
+def city_partitions(table):
+    """
+    Return the DDL of a gold table's list partitions, one per city with staged listings
+    plus a default partition for cities added after the build.
+    """
+    with engine.connect() as conn:
+        cities = conn.execute(
+            text(
+                """
+                SELECT city_id, city_name
+                FROM silver.city
+                WHERE city_name IN (SELECT city_name FROM gold.stg_listings_wide)
+                ORDER BY city_id
+                """
+            )
+        ).all()
+
+    partitions = [
+        f"""
+        CREATE TABLE {schema}.{table}_p{city_id} PARTITION OF {schema}.{table}
+        FOR VALUES IN ('{city_name.replace("'", "''")}');
+        """
+        for city_id, city_name in cities
     ]
-    grouped_listings[columns_to_round] = (
-        grouped_listings[columns_to_round].round(0).astype(int)
+    partitions.append(
+        f"CREATE TABLE {schema}.{table}_default PARTITION OF {schema}.{table} DEFAULT;"
     )
+    return "".join(partitions)
 
-    final_df = final_df.merge(grouped_listings, on="id", how="left")
-
-    final_df = final_df[
-        [
-            "id",
-            "neighbourhood_id",
-            "neighbourhood",
-            "city_name",
-            "property_type",
-            "room_type",
-            "accommodates",
-            "bedrooms",
-            "bathrooms",
-            "minimum_nights",
-            "maximum_nights",
-            "listing_url",
-            "picture_url",
-            "latitude",
-            "longitude",
-            "review_missing",
-            "review_scores_rating",
-            "categorized_amenities",
-            "price_float",
-            "seasonal_prices",
-        ]
-    ]
 
-    dtype_dict = {
-        "id": BIGINT(),
-        "neighbourhood_id": INTEGER(),
-        "neighbourhood": VARCHAR(),
-        "city_name": VARCHAR(),
-        "property_type": VARCHAR(),
-        "room_type": VARCHAR(),
-        "accommodates": INTEGER(),
-        "bedrooms": INTEGER(),
-        "bathrooms": INTEGER(),
-        "minimum_nights": INTEGER(),
-        "maximum_nights": INTEGER(),
-        "listing_url": VARCHAR(),
-        "picture_url": VARCHAR(),
-        "latitude": FLOAT(),
-        "longitude": FLOAT(),
-        "review_missing": INTEGER(),
-        "review_scores_rating": FLOAT(),
-        "categorized_amenities": JSONB(),
-        "price_float": FLOAT(),
-        "seasonal_prices": JSONB(),
-    }
-    final_df.to_sql(
-        "listings_aggregated",
-        engine,
-        schema="gold",
-        index=False,
-        method="multi",
-        chunksize=20000,
-        dtype=dtype_dict,
+def build_table(table, query, primary_key, after_build=""):
+    """
+    Build a gold table in the new version's schema, list partitioned on city_name so the
+    app's city filters only scan that city's partition, with the categorical columns
+    encoded as the version's enums. A full refresh runs the query for every listing, an
+    incremental one copies the active version's rows of unchanged listings and runs the
+    query only for the changed ones. The indexes recommended by index_advisor.py are
+    created on every version.
+    """
+    constraint, columns = primary_key
+    # Before the transaction, the builders run in parallel on a pool with a connection
+    # per worker and would wait on each other for a second one
+    partitions = city_partitions(table)
+    indexes = "".join(
+        f"CREATE INDEX {index_name} ON {schema}.{table} {definition};"
+        for index_name, definition in get_recommended_indexes(engine, table)
     )
-    session.execute(
-        text(
-            """
-        ALTER TABLE gold.listings_aggregated
-        ADD CONSTRAINT pk_listings PRIMARY KEY (id)
-     """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                CREATE TABLE {schema}.{table}__shape AS
+                {query.format(changed="FALSE")}
+                WITH NO DATA
+                """
+            )
+        )
+        table_columns = (
+            conn.execute(
+                text(
+                    """
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_schema = :schema AND table_name = :table
+                    ORDER BY ordinal_position
+                    """
+                ),
+                {"schema": schema, "table": f"{table}__shape"},
+            )
+            .scalars()
+            .all()
+        )
+        encoded = [column for column in table_columns if column in enum_types]
+        projection = ", ".join(
+            (
+                f"q.{column}::text::{enum_types[column]}"
+                if column in enum_types
+                else f"q.{column}"
+            )
+            for column in table_columns
         )
-    )
 
+        if incremental:
+            # Every version is a complete schema of its own, so the unchanged rows are
+            # still copied from the active version and each run rewrites whole tables.
+            # Only the expensive builder query is limited to the changed listings,
+            # attaching the active version's partitions instead would take them away
+            # from it and break rollbacks.
+            rows = f"""
+            INSERT INTO {schema}.{table}
+            SELECT {projection}
+            FROM (SELECT * FROM {active_schema}.{table} WHERE NOT {changed_listings}) q;
+
+            INSERT INTO {schema}.{table}
+            SELECT {projection}
+            FROM ({query.format(changed=changed_listings)}) q;
+            """
+        else:
+            rows = f"""
+            INSERT INTO {schema}.{table}
+            SELECT {projection}
+            FROM ({query.format(changed="TRUE")}) q;
+            """
 
-print("lisitings_aggregated inserted into the database successfully!")
+        alter = ",".join(
+            f"""
+            ALTER COLUMN {column} TYPE {enum_types[column]}
+                USING {column}::text::{enum_types[column]}"""
+            for column in encoded
+        )
+        build = f"""
+        {f"ALTER TABLE {schema}.{table}__shape {alter};" if encoded else ""}
 
-listings_aggregated()
+        CREATE TABLE {schema}.{table} (LIKE {schema}.{table}__shape)
+        PARTITION BY LIST (city_name);
 
+        DROP TABLE {schema}.{table}__shape;
+        {partitions}
+        {rows}
 
-def earnings_summary():
-    query = """
-    SELECT 
-        l.id, 
-        l.date_id,
-        l.season,
-        n.neighbourhood_id,
-        n.neighbourhood, 
-        c.city_name,
-        p.property_type,
-        r.room_type, 
-        l.accommodates,
-        l.bedrooms,
-        l.bathrooms,
-        l.latitude,
-        l.longitude,
-        ha.host_is_superhost,
-        ha.host_identity_verified,
-        ha.host_response_time,
-        l.review_missing,
-        l.review_scores_rating, 
-        l.categorized_amenities,
-        l.price_float
-    FROM silver.listings AS l
-    LEFT JOIN silver.property_types AS p ON l.property_id = p.property_id
-    LEFT JOIN silver.room_types AS r ON l.room_type_id = r.room_type_id
-    LEFT JOIN silver.city AS c ON l.city_id = c.city_id
-    LEFT JOIN silver.neighbourhoods AS n ON l.neighbourhood_id = n.neighbourhood_id
-    LEFT JOIN silver.host_activity AS ha 
-        ON l.host_id = ha.host_id 
-        AND l.date_id = ha.date_id 
-        AND l.id = ha.listing_id;
+        ALTER TABLE {schema}.{table}
+        ADD CONSTRAINT {constraint} PRIMARY KEY ({columns}, city_name);
+        {indexes}
+
+        ANALYZE {schema}.{table};
+        {after_build}
         """
-    earnings_df = pd.read_sql(query, engine)
+        conn.execute(text(build))
+
+
+listings_aggregated_query = """
+    SELECT
+        w.id,
+        (array_agg(w.neighbourhood_id ORDER BY w.date_id)
+            FILTER (WHERE w.neighbourhood_id IS NOT NULL))[1] AS neighbourhood_id,
+        (array_agg(w.neighbourhood ORDER BY w.date_id)
+            FILTER (WHERE w.neighbourhood IS NOT NULL))[1] AS neighbourhood,
+        (array_agg(w.city_name ORDER BY w.date_id)
+            FILTER (WHERE w.city_name IS NOT NULL))[1] AS city_name,
+        (array_agg(w.property_type ORDER BY w.date_id)
+            FILTER (WHERE w.property_type IS NOT NULL))[1] AS property_type,
+        (array_agg(w.room_type ORDER BY w.date_id)
+            FILTER (WHERE w.room_type IS NOT NULL))[1] AS room_type,
+        round(avg(w.accommodates))::INTEGER AS accommodates,
+        round(avg(w.bedrooms))::INTEGER AS bedrooms,
+        round(avg(w.bathrooms))::INTEGER AS bathrooms,
+        round(avg(w.minimum_nights))::INTEGER AS minimum_nights,
+        round(avg(w.maximum_nights))::INTEGER AS maximum_nights,
+        (array_agg(lu.content ORDER BY w.date_id)
+            FILTER (WHERE lu.content IS NOT NULL))[1] AS listing_url,
+        (array_agg(pu.content ORDER BY w.date_id)
+            FILTER (WHERE pu.content IS NOT NULL))[1] AS picture_url,
+        avg(w.latitude) AS latitude,
+        avg(w.longitude) AS longitude,
+        round(avg(w.review_missing))::INTEGER AS review_missing,
+        avg(w.review_scores_rating) AS review_scores_rating,
+        avg(w.price_float) AS price_float,
+        avg(w.price_float) FILTER (WHERE w.season = 'Early Spring') AS price_early_spring,
+        avg(w.price_float) FILTER (WHERE w.season = 'Early Summer') AS price_early_summer,
+        avg(w.price_float) FILTER (WHERE w.season = 'Early Autumn') AS price_early_autumn,
+        avg(w.price_float) FILTER (WHERE w.season = 'Early Winter') AS price_early_winter
+    FROM (SELECT * FROM gold.stg_listings_wide WHERE {changed}) w
+    LEFT JOIN silver.texts lu ON w.listing_url_hash = lu.text_hash
+    LEFT JOIN silver.texts pu ON w.picture_url_hash = pu.text_hash
+    GROUP BY w.id
+"""
 
-    query = """
-    SELECT * 
-    FROM silver.calendar
-    """
-    calendar_df = pd.read_sql(query, engine)
-    calendar_df = calendar_df.pivot_table(
-        index=["id", "season"], columns="available", values="count"
-    ).reset_index()
-    calendar_df = calendar_df.rename(
-        columns={0: "unavailable_days", 1: "available_days"}
-    )
-    df = pd.merge(earnings_df, calendar_df, on=["id", "season"], how="left")
-    df[["unavailable_days", "available_days"]] = (
-        df[["unavailable_days", "available_days"]].fillna(0).astype("int")
-    )
-    df["host_is_superhost"] = df["host_is_superhost"].map(
-        {"unknown": 2, "t": 1, "f": 0}
+
+def listings_aggregated():
+    """
+    Build listings_aggregated in the new gold version, one row per listing.
+    Descriptive columns take the first non-null value ordered by date_id and the
+    numeric columns are averaged over every quarter of the listing. Seasonal prices
+    are pivoted into one column per season, the listings_aggregated_json view keeps the
+    old seasonal_prices JSON shape for compatibility.
+    """
+    listings_json_view = f"""
+    CREATE VIEW {schema}.listings_aggregated_json AS
+    SELECT
+        la.*,
+        jsonb_strip_nulls(
+            jsonb_build_object(
+                'Early Spring', la.price_early_spring,
+                'Early Summer', la.price_early_summer,
+                'Early Autumn', la.price_early_autumn,
+                'Early Winter', la.price_early_winter
+            )
+        ) AS seasonal_prices
+    FROM {schema}.listings_aggregated la;
+    """
+    build_table(
+        "listings_aggregated",
+        listings_aggregated_query,
+        ("pk_listings", "id"),
+        after_build=listings_json_view,
     )
-    df = df[~df["host_identity_verified"].isnull()]
-    df["host_identity_verified"] = df["host_identity_verified"].map({"t": 1, "f": 0})
-    df = df[
-        [
-            "id",
-            "neighbourhood_id",
-            "neighbourhood",
-            "city_name",
-            "season",
-            "property_type",
-            "room_type",
-            "accommodates",
-            "bedrooms",
-            "bathrooms",
-            "latitude",
-            "longitude",
-            "host_is_superhost",
-            "host_identity_verified",
-            "host_response_time",
-            "review_missing",
-            "review_scores_rating",
-            "categorized_amenities",
-            "unavailable_days",
-            "available_days",
-            "price_float",
-        ]
-    ]
 
-    dtype_dict = {
-        "id": BIGINT(),
-        "neighbourhood_id": INTEGER(),
-        "neighbourhood": VARCHAR(),
-        "city_name": VARCHAR(),
-        "season": VARCHAR(20),
-        "property_type": VARCHAR(),
-        "room_type": VARCHAR(),
-        "accommodates": INTEGER(),
-        "bedrooms": INTEGER(),
-        "bathrooms": INTEGER(),
-        "latitude": FLOAT(),
-        "longitude": FLOAT(),
-        "host_is_superhost": INTEGER(),
-        "host_identity_verified": INTEGER(),
-        "host_response_time": VARCHAR(30),
-        "review_missing": INTEGER(),
-        "review_scores_rating": FLOAT(),
-        "categorized_amenities": JSONB(),
-        "unavailable_days": INTEGER(),
-        "available_days": INTEGER(),
-        "price_float": FLOAT(),
-    }
-    df.to_sql(
-        "earnings_summary",
-        engine,
-        schema="gold",
-        index=False,
-        method="multi",
-        chunksize=20000,
-        dtype=dtype_dict,
+    print("lisitings_aggregated inserted into the database successfully!")
+
+
+earnings_summary_query = """
+    WITH calendar AS (
+        SELECT
+            id,
+            season,
+            trunc(avg("count") FILTER (WHERE available = 0)) AS unavailable_days,
+            trunc(avg("count") FILTER (WHERE available = 1)) AS available_days
+        FROM silver.calendar
+        WHERE {changed}
+        GROUP BY id, season
     )
-    session.execute(
-        text(
-            """
-        ALTER TABLE gold.earnings_summary
-        ADD CONSTRAINT pk_listings_summary PRIMARY KEY (id, season)
+    SELECT
+        w.id,
+        w.neighbourhood_id,
+        w.neighbourhood,
+        w.city_name,
+        w.season,
+        w.property_type,
+        w.room_type,
+        w.accommodates,
+        w.bedrooms,
+        w.bathrooms,
+        w.latitude,
+        w.longitude,
+        CASE w.host_is_superhost
+            WHEN 'unknown' THEN 2 WHEN 't' THEN 1 WHEN 'f' THEN 0
+        END AS host_is_superhost,
+        CASE w.host_identity_verified WHEN 't' THEN 1 WHEN 'f' THEN 0
+        END AS host_identity_verified,
+        w.host_response_time,
+        w.review_missing,
+        w.review_scores_rating,
+        COALESCE(cal.unavailable_days, 0)::INTEGER AS unavailable_days,
+        COALESCE(cal.available_days, 0)::INTEGER AS available_days,
+        w.price_float
+    FROM (SELECT * FROM gold.stg_listings_wide WHERE {changed}) w
+    LEFT JOIN calendar cal ON w.id = cal.id AND w.season = cal.season
+    WHERE w.host_identity_verified IS NOT NULL
+"""
+
+
+def earnings_summary():
     """
-        )
+    Build earnings_summary in the new gold version, one row per listing and season with
+    the calendar availability pivoted into available and unavailable days.
+    """
+    build_table(
+        "earnings_summary",
+        earnings_summary_query,
+        ("pk_listings_summary", "id, season"),
     )
-    session.commit()
 
     print("earnings_summary inserted into the database successfully!")
 
 
-earnings_summary()
+reccomendation_summary_query = """
+    SELECT
+        w.id,
+        w.name_hash,
+        w.description_hash,
+        w.listing_url_hash,
+        first_value(w.picture_url_hash) OVER (
+            PARTITION BY w.id
+            ORDER BY w.picture_url_hash IS NULL, w.date_id
+            ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+        ) AS picture_url_hash,
+        w.season,
+        w.city_name,
+        w.neighbourhood,
+        w.room_type,
+        w.accommodates,
+        w.bedrooms,
+        w.bathrooms,
+        w.latitude,
+        w.longitude,
+        w.host_name,
+        w.host_about_hash,
+        w.host_response_time,
+        w.host_picture_url,
+        w.minimum_nights,
+        w.maximum_nights,
+        w.review_scores_rating,
+        w.price_float,
+        CASE
+            WHEN w.price_float < 20 THEN 'Extremely Cheap (<$20)'
+            WHEN w.price_float >= 20 AND w.price_float < 50 THEN 'Very Cheap ($20-$50)'
+            WHEN w.price_float >= 50 AND w.price_float < 100 THEN 'Cheap ($50-$100)'
+            WHEN w.price_float >= 100 AND w.price_float < 200 THEN 'Moderate ($100-$200)'
+            WHEN w.price_float >= 200 AND w.price_float < 300 THEN 'Expensive ($200-$300)'
+            ELSE 'Very Expensive (>$300)'
+        END AS price_range
+    FROM (SELECT * FROM gold.stg_listings_wide WHERE {changed}) w
+"""
 
 
 def reccomendation_summary():
-    query = """
-    SELECT 
-        l.id,
-        l.name,
-        l.description,
-        c.city_name,
-        n.neighbourhood,
-        r.room_type,
-        l.listing_url,
-        l.picture_url,
-        h.host_name,
-        ha.host_about,
-        ha.host_response_time,
-        ha.host_picture_url,
-        l.latitude,
-        l.longitude,
-        l.accommodates,
-        l.bedrooms,
-        l.bathrooms,
-        l.minimum_nights,
-        l.maximum_nights,
-        l.date_id,
-        l.season,
-        l.review_scores_rating,
-        l.categorized_amenities,
-        l.price_float,
-        CASE 
-            WHEN l.price_float < 20 THEN 'Extremely Cheap (<$20)'
-            WHEN l.price_float >= 20 AND l.price_float < 50 THEN 'Very Cheap ($20-$50)'
-            WHEN l.price_float >= 50 AND l.price_float < 100 THEN 'Cheap ($50-$100)'
-            WHEN l.price_float >= 100 AND l.price_float < 200 THEN 'Moderate ($100-$200)'
-            WHEN l.price_float >= 200 AND l.price_float < 300 THEN 'Expensive ($200-$300)'
-            ELSE 'Very Expensive (>$300)'
-        END AS price_range
-    FROM silver.listings l
-    LEFT JOIN silver.city c ON l.city_id = c.city_id
-    LEFT JOIN silver.neighbourhoods n ON l.neighbourhood_id = n.neighbourhood_id
-    LEFT JOIN silver.room_types r ON l.room_type_id = r.room_type_id
-    LEFT JOIN silver.host_details h ON l.host_id = h.host_id
-    LEFT JOIN silver.host_activity AS ha 
-        ON l.host_id = ha.host_id 
-        AND l.date_id = ha.date_id 
-        AND l.id = ha.listing_id;
     """
-    reccomendation_df = pd.read_sql(query, engine)
-    reccomendation_df["categorized_amenities"] = reccomendation_df[
-        "categorized_amenities"
-    ].replace(["None", "null"], np.nan)
+    Build reccomendations_summary in the new gold version, one row per listing and season.
+    Every season shows the listing's first non-null picture ordered by date_id.
+    """
+    build_table(
+        "reccomendations_summary",
+        reccomendation_summary_query,
+        ("pk_reccomendation_summary", "id, season"),
+    )
 
-    reccomendation_df = reccomendation_df.sort_values(by="date_id", ascending=False)
+    print("reccomendations inserted into the database successfully!")
 
-    picture_url = reccomendation_df.groupby("id")["picture_url"].last().reset_index()
-    reccomendation_df = reccomendation_df.merge(
-        picture_url, on="id", suffixes=("", "_latest")
-    )
-    reccomendation_df["picture_url"] = reccomendation_df["picture_url_latest"]
 
-    categories = (
-        reccomendation_df.groupby("id")["categorized_amenities"].last().reset_index()
+def neighbourhood_stats():
+    """
+    Build neighbourhood_stats in the new gold version, one row per neighbourhood with the
+    price summary used by the Earnings Estimator: averages, a 95% confidence interval
+    (t-distribution up to 30 listings, normal above) and the box plot quartiles.
+    """
+    critical_values = ", ".join(
+        f"({n}, {stats.t.ppf(0.975, n - 1)})" for n in range(2, 31)
     )
-    reccomendation_df = reccomendation_df.merge(
-        categories, on="id", suffixes=("", "_latest")
+    query = f"""
+    CREATE TABLE {schema}.neighbourhood_stats AS
+    WITH prices AS (
+        SELECT
+            neighbourhood,
+            count(*) AS listings,
+            avg(price_float) AS mean_price,
+            stddev_samp(price_float) AS std_price,
+            avg(accommodates) AS avg_accommodates,
+            avg(bedrooms) AS avg_bedrooms,
+            avg(bathrooms) AS avg_bathrooms,
+            percentile_cont(0.25) WITHIN GROUP (ORDER BY price_float) AS q1,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY price_float) AS median,
+            percentile_cont(0.75) WITHIN GROUP (ORDER BY price_float) AS q3
+        FROM {schema}.earnings_summary
+        WHERE neighbourhood IS NOT NULL
+        GROUP BY neighbourhood
+    ),
+    fences AS (
+        SELECT
+            e.neighbourhood,
+            min(e.price_float) AS lower_fence,
+            max(e.price_float) AS upper_fence
+        FROM {schema}.earnings_summary e
+        JOIN prices p ON e.neighbourhood = p.neighbourhood
+        WHERE e.price_float BETWEEN p.q1 - 1.5 * (p.q3 - p.q1)
+            AND p.q3 + 1.5 * (p.q3 - p.q1)
+        GROUP BY e.neighbourhood
+    ),
+    t_values (listings, critical_value) AS (
+        VALUES {critical_values}
+    ),
+    intervals AS (
+        SELECT
+            p.*,
+            CASE
+                WHEN p.listings > 1 AND p.std_price > 0
+                THEN COALESCE(t.critical_value, {stats.norm.ppf(0.975)})
+                    * p.std_price / sqrt(p.listings)
+                ELSE 0
+            END AS margin_of_error
+        FROM prices p
+        LEFT JOIN t_values t ON p.listings = t.listings
     )
+    SELECT
+        i.neighbourhood,
+        i.listings,
+        i.mean_price,
+        i.std_price,
+        i.mean_price - i.margin_of_error AS lower_bound,
+        i.mean_price + i.margin_of_error AS upper_bound,
+        i.avg_accommodates,
+        i.avg_bedrooms,
+        i.avg_bathrooms,
+        i.q1,
+        i.median,
+        i.q3,
+        f.lower_fence,
+        f.upper_fence
+    FROM intervals i
+    LEFT JOIN fences f ON i.neighbourhood = f.neighbourhood;
+
+    ALTER TABLE {schema}.neighbourhood_stats
+    ADD CONSTRAINT pk_neighbourhood_stats PRIMARY KEY (neighbourhood);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
+
+    print("neighbourhood_stats inserted into the database successfully!")
 
-    reccomendation_df["categorized_amenities"] = reccomendation_df[
-        "categorized_amenities"
-    ].fillna(reccomendation_df["categorized_amenities_latest"])
 
-    reccomendation_df.drop(
-        columns=["categorized_amenities_latest", "picture_url_latest", "date_id"],
-        inplace=True,
+def neighbourhood_geo():
+    """
+    Build neighbourhood_geo in the new gold version, one row per neighbourhood with the
+    average listing location, its distance to the city center, and the polygon centroid
+    and bounding box used to center the maps.
+    """
+    query = f"""
+    CREATE TABLE {schema}.neighbourhood_geo AS
+    WITH listings AS (
+        SELECT
+            neighbourhood_id,
+            count(*) AS listings,
+            avg(latitude) AS latitude,
+            avg(longitude) AS longitude
+        FROM {schema}.earnings_summary
+        GROUP BY neighbourhood_id
     )
+    SELECT
+        n.neighbourhood_id,
+        n.neighbourhood,
+        c.city_name,
+        COALESCE(l.listings, 0) AS listings,
+        l.latitude,
+        l.longitude,
+        sqrt(
+            power(l.latitude - c.center_latitude, 2)
+            + power(l.longitude - c.center_longitude, 2)
+        ) AS distance_to_center,
+        c.center_latitude,
+        c.center_longitude,
+        n.centroid_latitude,
+        n.centroid_longitude,
+        n.min_latitude,
+        n.min_longitude,
+        n.max_latitude,
+        n.max_longitude
+    FROM silver.neighbourhoods n
+    JOIN silver.city c ON n.city_id = c.city_id
+    LEFT JOIN listings l ON n.neighbourhood_id = l.neighbourhood_id;
+
+    ALTER TABLE {schema}.neighbourhood_geo
+    ADD CONSTRAINT pk_neighbourhood_geo PRIMARY KEY (neighbourhood_id);
+
+    CREATE INDEX idx_neighbourhood_geo_city
+    ON {schema}.neighbourhood_geo (city_name, neighbourhood);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
 
-    reccomendation_df["categorized_amenities"] = reccomendation_df[
-        "categorized_amenities"
-    ].apply(lambda x: json.loads(x) if isinstance(x, str) else x)
-
-    reccomendation_df["categorized_amenities"] = reccomendation_df[
-        "categorized_amenities"
-    ].fillna({})
-    reccomendation_df = reccomendation_df[
-        [
-            "id",
-            "name",
-            "description",
-            "listing_url",
-            "picture_url",
-            "season",
-            "city_name",
-            "neighbourhood",
-            "room_type",
-            "accommodates",
-            "bedrooms",
-            "bathrooms",
-            "latitude",
-            "longitude",
-            "host_name",
-            "host_about",
-            "host_response_time",
-            "host_picture_url",
-            "minimum_nights",
-            "maximum_nights",
-            "review_scores_rating",
-            "categorized_amenities",
-            "price_float",
-            "price_range",
-        ]
-    ]
+    print("neighbourhood_geo inserted into the database successfully!")
 
-    dtype_dict = {
-        "id": BIGINT(),
-        "name": VARCHAR(),
-        "description": VARCHAR(),
-        "listing_url": VARCHAR(),
-        "picture_url": VARCHAR(),
-        "season": VARCHAR(),
-        "city_name": VARCHAR(),
-        "neighbourhood": VARCHAR(),
-        "room_type": VARCHAR(),
-        "accommodates": INTEGER(),
-        "bedrooms": INTEGER(),
-        "bathrooms": INTEGER(),
-        "latitude": FLOAT(),
-        "longitude": FLOAT(),
-        "host_name": VARCHAR(),
-        "host_about": VARCHAR(),
-        "host_response_time": VARCHAR(),
-        "host_picture_url": VARCHAR(),
-        "minimum_nights": INTEGER(),
-        "maximum_nights": INTEGER(),
-        "review_scores_rating": FLOAT(),
-        "categorized_amenities": JSON(),
-        "price_float": FLOAT(),
-        "price_range": VARCHAR(),
-    }
-    reccomendation_df.to_sql(
-        "reccomendations_summary",
-        engine,
-        schema="gold",
-        index=False,
-        method="multi",
-        chunksize=20000,
-        dtype=dtype_dict,
-    )
-    session.execute(
-        text(
-            """
-        ALTER TABLE gold.reccomendations_summary
-        ADD CONSTRAINT pk_reccomendation_summary PRIMARY KEY (id, season)
+
+def filter_cube():
     """
-        )
+    Build filter_cube in the new gold version, the listing counts and mean price of every
+    combination of the search filters within a city. grouping_set holds the GROUPING bits
+    of the rolled up filters, so an unfiltered dimension is told apart from a NULL value.
+    """
+    query = f"""
+    CREATE TABLE {schema}.filter_cube AS
+    SELECT
+        city_name,
+        neighbourhood,
+        room_type,
+        accommodates,
+        season,
+        price_range,
+        GROUPING(neighbourhood, room_type, accommodates, season, price_range)
+            AS grouping_set,
+        count(DISTINCT id) AS listings,
+        count(*) AS listing_seasons,
+        avg(price_float) AS avg_price
+    FROM {schema}.reccomendations_summary
+    WHERE city_name IS NOT NULL
+    GROUP BY city_name, CUBE(neighbourhood, room_type, accommodates, season, price_range);
+
+    CREATE INDEX idx_filter_cube ON {schema}.filter_cube (city_name, grouping_set);
+    ANALYZE {schema}.filter_cube;
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
+
+    print("filter_cube inserted into the database successfully!")
+
+
+def listings_cube():
+    """
+    Build listings_cube in the new gold version, the listing counts of every combination
+    of the Raw Map filters within a city. The map searches listings_aggregated, whose
+    accommodates is averaged over the quarters, so filter_cube's per season values
+    would not match it.
+    """
+    query = f"""
+    CREATE TABLE {schema}.listings_cube AS
+    SELECT
+        city_name,
+        neighbourhood,
+        room_type,
+        accommodates,
+        GROUPING(neighbourhood, room_type, accommodates) AS grouping_set,
+        count(*) AS listings
+    FROM {schema}.listings_aggregated
+    WHERE city_name IS NOT NULL
+    GROUP BY city_name, CUBE(neighbourhood, room_type, accommodates);
+
+    CREATE INDEX idx_listings_cube ON {schema}.listings_cube (city_name, grouping_set);
+    ANALYZE {schema}.listings_cube;
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
+
+    print("listings_cube inserted into the database successfully!")
+
+
+def neighbourhood_trends():
+    """
+    Build neighbourhood_trends in the new gold version, one row per neighbourhood, room
+    type and quarter with the median price, listing count, mean rating and calendar
+    occupancy, plus their change from the previous quarter.
+    """
+    query = f"""
+    CREATE TABLE {schema}.neighbourhood_trends AS
+    WITH occupancy AS (
+        SELECT
+            id,
+            season,
+            (sum("count") FILTER (WHERE available = 0))::FLOAT
+                / NULLIF(sum("count") FILTER (WHERE available IN (0, 1)), 0)
+                AS occupancy_rate
+        FROM silver.calendar
+        GROUP BY id, season
+    ),
+    quarters AS (
+        SELECT
+            w.neighbourhood_id,
+            w.neighbourhood,
+            w.city_name,
+            w.room_type,
+            w.date_id,
+            d.date AS quarter,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY w.price_float) AS median_price,
+            count(DISTINCT w.id) AS listings,
+            avg(w.review_scores_rating) AS avg_rating,
+            avg(o.occupancy_rate) AS occupancy_rate
+        FROM gold.stg_listings_wide w
+        JOIN silver.dates d ON w.date_id = d.date_id
+        LEFT JOIN occupancy o ON w.id = o.id AND w.season = o.season
+        WHERE w.neighbourhood_id IS NOT NULL AND w.room_type IS NOT NULL
+        GROUP BY
+            w.neighbourhood_id,
+            w.neighbourhood,
+            w.city_name,
+            w.room_type,
+            w.date_id,
+            d.date
     )
-    session.commit()
+    SELECT
+        q.*,
+        q.median_price - lag(q.median_price) OVER quarter AS median_price_change,
+        q.median_price / NULLIF(lag(q.median_price) OVER quarter, 0) - 1
+            AS median_price_pct_change,
+        q.listings - lag(q.listings) OVER quarter AS listings_change,
+        q.avg_rating - lag(q.avg_rating) OVER quarter AS avg_rating_change,
+        q.occupancy_rate - lag(q.occupancy_rate) OVER quarter AS occupancy_rate_change
+    FROM quarters q
+    WINDOW quarter AS (PARTITION BY q.neighbourhood_id, q.room_type ORDER BY q.date_id);
+
+    ALTER TABLE {schema}.neighbourhood_trends
+    ADD CONSTRAINT pk_neighbourhood_trends
+    PRIMARY KEY (neighbourhood_id, room_type, date_id);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
 
-    print("reccomendations inserted into the database successfully!")
+    print("neighbourhood_trends inserted into the database successfully!")
 
 
-reccomendation_summary()
+def warm_version():
+    """
+    Load the new version's tables and indexes into shared buffers with pg_prewarm,
+    when the extension is installed, so the first pages after the switch stay fast.
+    """
+    query = """
+    SELECT pg_prewarm(c.oid)
+    FROM pg_class c
+    JOIN pg_namespace n ON c.relnamespace = n.oid
+    WHERE n.nspname = :schema AND c.relkind IN ('r', 'i')
+    """
+    with engine.begin() as conn:
+        if not conn.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+        ).first():
+            print("pg_prewarm is not installed, skipping the warm up")
+            return
+        conn.execute(text(query), {"schema": schema})
+
+    print(f"{schema} warmed successfully!")
+
+
+def publish_version():
+    """Switch the app to the new version and drop the versions no longer kept"""
+    register_version(engine, version, schema)
+    activate_version(engine, version)
+    prune_versions(engine, keep=keep_versions)
+
+
+run_tasks(
+    {
+        "stg_listings_wide": (listings_wide, []),
+        "listing_changes": (listing_changes, ["stg_listings_wide"]),
+        "enum_types": (create_enum_types, ["stg_listings_wide"]),
+        "listings_aggregated": (
+            listings_aggregated,
+            ["listing_changes", "enum_types"],
+        ),
+        "earnings_summary": (earnings_summary, ["listing_changes", "enum_types"]),
+        "reccomendations_summary": (
+            reccomendation_summary,
+            ["listing_changes", "enum_types"],
+        ),
+        "neighbourhood_stats": (neighbourhood_stats, ["earnings_summary"]),
+        "neighbourhood_geo": (neighbourhood_geo, ["earnings_summary"]),
+        "filter_cube": (filter_cube, ["reccomendations_summary"]),
+        "listings_cube": (listings_cube, ["listings_aggregated"]),
+        "neighbourhood_trends": (neighbourhood_trends, ["stg_listings_wide"]),
+        "warm_version": (
+            warm_version,
+            [
+                "listings_aggregated",
+                "neighbourhood_stats",
+                "neighbourhood_geo",
+                "filter_cube",
+                "listings_cube",
+                "neighbourhood_trends",
+            ],
+        ),
+        "publish_version": (publish_version, ["warm_version"]),
+    },
+    max_workers=max_workers,
+)
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.append("../..")
+from backend.db_connection import get_sqlalchemy_session
+from data_processing.gold.versions import activate_version, get_previous_version
+
+engine, session = get_sqlalchemy_session()
+
+# Switch the app back to the previous gold version, or to GOLD_VERSION when it is set.
+version = os.getenv("GOLD_VERSION") or get_previous_version(engine)
+if version is None:
+    raise ValueError("There is no previous gold version to roll back to")
+
+activate_version(engine, int(version))
@@ -0,0 +1,146 @@
+from sqlalchemy import text
+
+
+def create_versions_table(engine):
+    """
+    Create gold.versions, the pointer the app resolves to find the active gold schema.
+    The partial unique index allows a single active version at any time. Also create
+    gold.recommended_indexes, the indexes every new version builds on its tables.
+    """
+    query = """
+    CREATE SCHEMA IF NOT EXISTS gold;
+
+    CREATE TABLE IF NOT EXISTS gold.versions (
+        version INTEGER PRIMARY KEY,
+        schema_name TEXT NOT NULL UNIQUE,
+        built_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        activated_at TIMESTAMPTZ,
+        is_active BOOLEAN NOT NULL DEFAULT false
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_versions_active
+    ON gold.versions (is_active) WHERE is_active;
+
+    CREATE TABLE IF NOT EXISTS gold.recommended_indexes (
+        index_name TEXT PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        recommended_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query))
+
+
+def get_active_version(engine):
+    """Return the (version, schema_name) of the active gold version, or None"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT version, schema_name FROM gold.versions WHERE is_active")
+        ).first()
+
+
+def get_next_version(engine):
+    """Return the number of the next gold version to build"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT COALESCE(max(version), 0) + 1 FROM gold.versions")
+        ).scalar()
+
+
+def get_recommended_indexes(engine, table):
+    """Return the (index_name, definition) of the indexes recommended for a gold table"""
+    query = """
+    SELECT index_name, definition
+    FROM gold.recommended_indexes
+    WHERE table_name = :table
+    ORDER BY index_name
+    """
+    with engine.connect() as conn:
+        return conn.execute(text(query), {"table": table}).all()
+
+
+def save_recommended_index(engine, table, index_name, definition):
+    """
+    Record an index for the gold builds to create on `table` in every new version.
+    `definition` is the part of CREATE INDEX after the table name.
+    """
+    query = """
+    INSERT INTO gold.recommended_indexes (index_name, table_name, definition)
+    VALUES (:index_name, :table, :definition)
+    ON CONFLICT (index_name) DO UPDATE
+    SET table_name = EXCLUDED.table_name,
+        definition = EXCLUDED.definition,
+        recommended_at = now()
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(query),
+            {"index_name": index_name, "table": table, "definition": definition},
+        )
+
+
+def get_previous_version(engine):
+    """Return the newest version older than the active one, used for rollbacks"""
+    query = """
+    SELECT max(version)
+    FROM gold.versions
+    WHERE version < (SELECT version FROM gold.versions WHERE is_active)
+    """
+    with engine.connect() as conn:
+        return conn.execute(text(query)).scalar()
+
+
+def register_version(engine, version, schema_name):
+    """Record a fully built gold schema as an inactive version"""
+    query = """
+    INSERT INTO gold.versions (version, schema_name)
+    VALUES (:version, :schema_name)
+    """
+    with engine.begin() as conn:
+        conn.execute(text(query), {"version": version, "schema_name": schema_name})
+
+
+def activate_version(engine, version):
+    """
+    Point the app at a registered gold version. Both updates run in one transaction,
+    so readers always resolve exactly one active schema.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE gold.versions SET is_active = false WHERE is_active"))
+        activated = conn.execute(
+            text(
+                """
+                UPDATE gold.versions
+                SET is_active = true, activated_at = now()
+                WHERE version = :version
+                """
+            ),
+            {"version": version},
+        )
+        if activated.rowcount != 1:
+            raise ValueError(f"Gold version {version} does not exist")
+
+    print(f"gold_v{version} activated successfully!")
+
+
+def prune_versions(engine, keep=1):
+    """
+    Drop the schemas of old inactive versions, keeping the `keep` newest ones around
+    for rollbacks.
+    """
+    query = """
+    SELECT version, schema_name
+    FROM gold.versions
+    WHERE NOT is_active
+    ORDER BY version DESC
+    OFFSET :keep
+    """
+    with engine.begin() as conn:
+        for version, schema_name in conn.execute(text(query), {"keep": keep}).all():
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE"))
+            conn.execute(
+                text("DELETE FROM gold.versions WHERE version = :version"),
+                {"version": version},
+            )
+            print(f"{schema_name} dropped successfully!")
@@ -0,0 +1,256 @@
+import os
+import sys
+import statistics
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.append("..")
+from backend.db_connection import get_sqlalchemy_session
+from data_processing.gold.versions import (
+    create_versions_table,
+    get_active_version,
+    save_recommended_index,
+)
+
+engine, session = get_sqlalchemy_session()
+
+# "propose" rolls every candidate index back after measuring it, "apply" keeps the
+# ones that speed up at least one query by `min_speedup`. Gold indexes are also
+# recorded in gold.recommended_indexes, so every later gold version builds them.
+mode = os.getenv("INDEX_ADVISOR_MODE", "propose")
+repeats = int(os.getenv("INDEX_ADVISOR_REPEATS", 3))
+min_speedup = float(os.getenv("INDEX_ADVISOR_MIN_SPEEDUP", 1.2))
+
+active = get_active_version(engine)
+gold = active.schema_name if active else "gold"
+
+# Query shapes issued by backend/queries.py and the gold builders, keyed by the table
+# whose indexes decide their plan.
+workload = [
+    (
+        "data_query",
+        f"{gold}.listings_aggregated",
+        f"""
+        SELECT * FROM {gold}.listings_aggregated
+        WHERE city_name = :city_name AND neighbourhood = :neighbourhood
+            AND room_type = :room_type AND accommodates = :accommodates
+            AND 2 BETWEEN minimum_nights AND maximum_nights
+        ORDER BY id DESC
+        """,
+    ),
+    (
+        "reccomendation_query",
+        f"{gold}.reccomendations_summary",
+        f"""
+        SELECT * FROM {gold}.reccomendations_summary
+        WHERE city_name = :city_name AND neighbourhood = :neighbourhood
+            AND season = :season AND room_type = :room_type
+            AND accommodates = :accommodates AND price_range = :price_range
+            AND 2 BETWEEN minimum_nights AND maximum_nights
+        ORDER BY id DESC
+        """,
+    ),
+    (
+        "get_listing_amenities",
+        "silver.listing_amenities",
+        """
+        SELECT a.category, array_agg(a.amenity ORDER BY a.amenity)
+        FROM silver.listing_amenities la
+        JOIN silver.amenities a ON la.amenity_id = a.amenity_id
+        WHERE la.listing_id = :listing_id
+            AND la.date_id = (
+                SELECT max(date_id)
+                FROM silver.listing_amenities
+                WHERE listing_id = :listing_id
+            )
+        GROUP BY a.category
+        """,
+    ),
+    (
+        "get_neighbourhoods",
+        "silver.neighbourhoods",
+        """
+        SELECT DISTINCT n.neighbourhood, n.neighbourhood_id
+        FROM silver.neighbourhoods n
+        JOIN silver.city c ON n.city_id = c.city_id
+        WHERE c.city_name = :city_name
+        """,
+    ),
+    (
+        "listings_wide host join",
+        "silver.host_activity",
+        """
+        SELECT count(ha.host_picture_url)
+        FROM silver.listings l
+        LEFT JOIN silver.host_activity ha
+            ON l.host_id = ha.host_id
+            AND l.date_id = ha.date_id
+            AND l.id = ha.listing_id
+        WHERE l.city_id = (SELECT city_id FROM silver.city WHERE city_name = :city_name)
+        """,
+    ),
+    (
+        "earnings_summary calendar",
+        "silver.calendar",
+        """
+        SELECT id, season, avg("count") FILTER (WHERE available = 0)
+        FROM silver.calendar
+        WHERE id = :listing_id
+        GROUP BY id, season
+        """,
+    ),
+]
+
+# Composite and covering indexes matching the workload's filters and join keys
+candidates = [
+    (
+        "silver.host_activity",
+        "CREATE INDEX idx_host_activity_join ON silver.host_activity "
+        "(host_id, date_id, listing_id) INCLUDE (host_picture_url)",
+    ),
+    (
+        "silver.listing_amenities",
+        "CREATE INDEX idx_listing_amenities_listing ON silver.listing_amenities "
+        "(listing_id, date_id) INCLUDE (amenity_id)",
+    ),
+    (
+        "silver.calendar",
+        "CREATE INDEX idx_calendar_id_season ON silver.calendar "
+        '(id, season) INCLUDE (available, "count")',
+    ),
+    (
+        "silver.neighbourhoods",
+        "CREATE INDEX idx_neighbourhoods_city ON silver.neighbourhoods "
+        "(city_id) INCLUDE (neighbourhood)",
+    ),
+    (
+        f"{gold}.listings_aggregated",
+        "CREATE INDEX idx_listings_aggregated_filters "
+        f"ON {gold}.listings_aggregated (neighbourhood, room_type, accommodates) "
+        "INCLUDE (minimum_nights, maximum_nights)",
+    ),
+    (
+        f"{gold}.reccomendations_summary",
+        "CREATE INDEX idx_reccomendations_summary_filters "
+        f"ON {gold}.reccomendations_summary "
+        "(neighbourhood, season, room_type, accommodates, price_range) "
+        "INCLUDE (minimum_nights, maximum_nights)",
+    ),
+]
+
+
+def sample_parameters():
+    """
+    Pick realistic parameters for the workload: the most common filter combination of
+    the filter cube and a listing of that combination.
+    """
+    query = f"""
+    SELECT f.city_name, f.neighbourhood, f.room_type, f.accommodates, f.season,
+        f.price_range, min(r.id) AS listing_id
+    FROM {gold}.filter_cube f
+    JOIN {gold}.reccomendations_summary r
+        ON r.city_name = f.city_name AND r.neighbourhood = f.neighbourhood
+        AND r.room_type = f.room_type AND r.accommodates = f.accommodates
+        AND r.season = f.season AND r.price_range = f.price_range
+    WHERE f.grouping_set = 0
+    GROUP BY f.city_name, f.neighbourhood, f.room_type, f.accommodates, f.season,
+        f.price_range, f.listing_seasons
+    ORDER BY f.listing_seasons DESC
+    LIMIT 1
+    """
+    with engine.connect() as conn:
+        return dict(conn.execute(text(query)).mappings().one())
+
+
+def explain(conn, query, parameters):
+    """
+    Run a query under EXPLAIN ANALYZE `repeats` times and return the median execution
+    time in milliseconds and the indexes its plan used.
+    """
+    timings, indexes = [], set()
+    for _ in range(repeats):
+        plan = conn.execute(
+            text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}"), parameters
+        ).scalar()[0]
+        timings.append(plan["Execution Time"])
+
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            indexes.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+
+    return statistics.median(timings), indexes
+
+
+def run_workload(conn, parameters, tables=None):
+    """Return the timing and used indexes of every workload query on `tables`"""
+    return {
+        name: explain(conn, query, parameters)
+        for name, table, query in workload
+        if tables is None or table in tables
+    }
+
+
+def advise():
+    parameters = sample_parameters()
+    print(f"Replaying {len(workload)} queries with {parameters}")
+
+    with engine.connect() as conn:
+        baseline = run_workload(conn, parameters)
+
+    report = []
+    recommended = []
+    for table, ddl in candidates:
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            conn.execute(text(ddl))
+            conn.execute(text(f"ANALYZE {table}"))
+            measured = run_workload(conn, parameters, tables={table})
+            transaction.rollback()
+
+        for name, (after, indexes) in measured.items():
+            before, before_indexes = baseline[name]
+            speedup = before / after if after else float("inf")
+            report.append(
+                {
+                    "query": name,
+                    "index": ddl.split()[2],
+                    "before_ms": round(before, 3),
+                    "after_ms": round(after, 3),
+                    "speedup": round(speedup, 2),
+                    "new_index_used": bool(indexes - before_indexes),
+                }
+            )
+            if speedup >= min_speedup and indexes - before_indexes:
+                recommended.append((table, ddl))
+
+    print(pd.DataFrame(report).to_string(index=False))
+
+    recommended = list(dict.fromkeys(recommended))
+    if not recommended:
+        print("No index speeds up the workload enough to recommend it")
+        return
+
+    print("Recommended indexes:")
+    for _, ddl in recommended:
+        print(f"  {ddl};")
+
+    if mode == "apply":
+        create_versions_table(engine)
+        for table, ddl in recommended:
+            with engine.begin() as conn:
+                conn.execute(
+                    text(ddl.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS"))
+                )
+            if table.startswith(f"{gold}."):
+                index_name = ddl.split()[2]
+                definition = ddl.split(f" ON {table} ", 1)[1]
+                save_recommended_index(
+                    engine, table.split(".", 1)[1], index_name, definition
+                )
+        print(f"{len(recommended)} indexes applied successfully!")
+
+
+advise()
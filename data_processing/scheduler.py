@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_tasks(tasks, max_workers=4):
+    """
+    Run table load tasks concurrently while respecting their dependencies.
+
+    `tasks` maps a task name to a (function, dependencies) tuple. A task is submitted
+    as soon as every task it depends on has finished, and at most `max_workers` run at
+    the same time. If a task fails the queued tasks are cancelled, the running ones finish,
+    and the error is raised.
+    """
+    unknown = {
+        dependency
+        for _, dependencies in tasks.values()
+        for dependency in dependencies
+        if dependency not in tasks
+    }
+    if unknown:
+        raise ValueError(f"Unknown task dependencies: {sorted(unknown)}")
+
+    pending = dict(tasks)
+    done = set()
+    running = {}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [
+                name
+                for name, (_, dependencies) in pending.items()
+                if set(dependencies) <= done
+            ]
+            for name in ready:
+                function, _ = pending.pop(name)
+                running[executor.submit(_timed, name, function)] = name
+
+            if not running:
+                raise ValueError(f"Circular task dependencies: {sorted(pending)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    # Tasks still queued in the executor would otherwise run on exit
+                    for queued in running:
+                        queued.cancel()
+                    raise
+                done.add(name)
+
+    print(f"{len(done)} tasks finished in {time.perf_counter() - start:.1f}s")
+
+
+def _timed(name, function):
+    start = time.perf_counter()
+    function()
+    print(f"{name} finished in {time.perf_counter() - start:.1f}s")
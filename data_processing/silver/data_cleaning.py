@@ -15,7 +15,15 @@ from shapely.wkt import loads
 sys.path.append("../..")
 from backend.db_connection import get_duckdb_connection
 
-spark = SparkSession.builder.appName("data_cleaning").getOrCreate()
+# The PostgreSQL JDBC driver used by SILVER_WRITE_MODE=spark, fetched from Maven
+spark = (
+    SparkSession.builder.appName("data_cleaning")
+    .config(
+        "spark.jars.packages",
+        os.getenv("SPARK_JDBC_PACKAGE", "org.postgresql:postgresql:42.7.4"),
+    )
+    .getOrCreate()
+)
 
 
 from utilities.categories_dict import categories_final
@@ -54,10 +62,16 @@ selected_columns = [
     "year",
 ]
 
+text_columns = ["name", "description", "listing_url", "picture_url", "host_about"]
+
 file_path = "../../data/bronze_listings_raw.parquet"
 
 
-def get_and_clean_data():
+def get_clean_spark_data():
+    """
+    Clean the bronze listings with Spark and return the listings and the categorized
+    amenities as Spark DataFrames, so callers can write them without collecting.
+    """
     if not os.path.exists(file_path):
         con.sql(
             """
@@ -211,16 +225,11 @@ def get_and_clean_data():
     )
     amenities_df = amenities_df.filter(amenities_df["category"] != "Other")
 
-    grouped = amenities_df.groupBy("id", "date", "category").agg(
-        F.collect_list("amenities_split").alias("amenities_list")
-    )
-    grouped_dict = grouped.groupBy("id", "date").agg(
-        F.map_from_entries(
-            F.collect_list(F.struct("category", "amenities_list"))
-        ).alias("categorized_amenities")
-    )
+    amenities_df = amenities_df.select(
+        "id", "date", F.col("amenities_split").alias("amenity"), "category"
+    ).dropDuplicates(["id", "date", "amenity"])
 
-    final_df = df.join(grouped_dict, on=["id", "date"], how="left").drop(
+    final_df = df.drop(
         "price",
         "neighbourhood_cleansed",
         "bathrooms_text",
@@ -230,9 +239,10 @@ def get_and_clean_data():
         "quarter",
         "year",
     )
-    final_df = final_df.toPandas()
+    for column in text_columns:
+        final_df = final_df.withColumn(f"{column}_hash", F.md5(F.col(column)))
 
-    final_df = final_df[
+    final_df = final_df.select(
         [
             "id",
             "name",
@@ -253,7 +263,6 @@ def get_and_clean_data():
             "season",
             "review_missing",
             "review_scores_rating",
-            "categorized_amenities",
             "host_id",
             "host_name",
             "host_about",
@@ -265,8 +274,14 @@ def get_and_clean_data():
             "date",
             "price_float",
         ]
-    ]
-    return final_df
+        + [f"{column}_hash" for column in text_columns]
+    )
+    return final_df, amenities_df
+
+
+def get_and_clean_data():
+    final_df, amenities_df = get_clean_spark_data()
+    return final_df.toPandas(), amenities_df.toPandas()
 
 
 def clean_json():
@@ -289,3 +304,32 @@ def clean_json():
         crs="EPSG:4326",
     )
     return geojson_df
+
+
+def assign_neighbourhoods(listings_df, neighbourhoods_df, max_distance=0.01):
+    """
+    Return the id of the neighbourhood polygon containing each listing's coordinates.
+    Points that fall just outside every polygon (coastline, borders) take the nearest
+    polygon within max_distance degrees, the rest are left as NaN.
+    """
+    points = shapely.points(
+        listings_df["longitude"].to_numpy(), listings_df["latitude"].to_numpy()
+    )
+    tree = shapely.STRtree(neighbourhoods_df["geometry"].to_numpy())
+
+    assigned = np.full(len(points), -1)
+    point_idx, polygon_idx = tree.query(points, predicate="within")
+    assigned[point_idx] = polygon_idx
+
+    missing = np.flatnonzero(assigned == -1)
+    if len(missing):
+        point_idx, polygon_idx = tree.query_nearest(
+            points[missing], max_distance=max_distance, all_matches=False
+        )
+        assigned[missing[point_idx]] = polygon_idx
+
+    neighbourhood_ids = neighbourhoods_df["neighbourhood_id"].to_numpy()
+    return pd.Series(
+        np.where(assigned >= 0, neighbourhood_ids[assigned], np.nan),
+        index=listings_df.index,
+    )
@@ -1,27 +1,61 @@
+import os
 import sys
 from sqlalchemy.orm import sessionmaker
+from functools import reduce
 from sqlalchemy import (
     SMALLINT,
     VARCHAR,
     INTEGER,
     BIGINT,
     FLOAT,
+    TEXT,
+    TIMESTAMP,
     text,
 )
-from sqlalchemy.dialects.postgresql import JSONB
-import json
+from sqlalchemy.dialects.postgresql import UUID
 import pandas as pd
 import duckdb
+import shapely
+import pyspark.sql.functions as F
+from pyspark.sql import DataFrame
 
 sys.path.append("..")
 sys.path.append("../..")
-from backend.db_connection import get_sqlalchemy_session
+from backend.db_connection import get_sqlalchemy_session, get_jdbc_options
+from silver.data_cleaning import spark
 from silver.data_cleaning import get_and_clean_data
+from silver.data_cleaning import get_clean_spark_data
 from silver.data_cleaning import clean_json
-
-engine, session = get_sqlalchemy_session()
-
-df = get_and_clean_data()
+from silver.data_cleaning import assign_neighbourhoods
+from silver.data_cleaning import text_columns
+from scheduler import run_tasks
+from utilities.city_centers import city_centers
+
+max_workers = int(os.getenv("SILVER_LOAD_WORKERS", 4))
+engine, session = get_sqlalchemy_session(pool_size=max_workers, max_overflow=0)
+
+# "pandas" collects the cleaned data on the driver and writes it with to_sql,
+# "spark" writes the large tables straight from the Spark partitions over JDBC, with
+# the driver from SPARK_JDBC_PACKAGE (see the SparkSession in data_cleaning.py).
+write_mode = os.getenv("SILVER_WRITE_MODE", "pandas")
+write_partitions = int(os.getenv("SILVER_WRITE_PARTITIONS", 8))
+
+if write_mode == "spark":
+    spark_df, spark_amenities_df = get_clean_spark_data()
+    spark_df = spark_df.persist()
+    spark_amenities_df = spark_amenities_df.persist()
+    df = (
+        spark_df.select("city", "property_type", "room_type", "date")
+        .distinct()
+        .toPandas()
+    )
+    amenities_df = (
+        spark_amenities_df.select("amenity", "category")
+        .dropDuplicates(["amenity"])
+        .toPandas()
+    )
+else:
+    df, amenities_df = get_and_clean_data()
 geojson_df = clean_json()
 calendar_path = r"../../data/calendar_with_season.parquet"
 
@@ -47,15 +81,20 @@ def insert_calendar_table(path):
         print(f"Error inserting data into Bronze table: {e}")
 
 
-insert_calendar_table(calendar_path)
-
-
 def city_table():
     city_df = pd.DataFrame(df["city"].unique(), columns=["city_name"])
+    city_df["center_latitude"] = city_df["city_name"].map(
+        lambda city: city_centers.get(city, {}).get("latitude")
+    )
+    city_df["center_longitude"] = city_df["city_name"].map(
+        lambda city: city_centers.get(city, {}).get("longitude")
+    )
 
     dtype_dict = {
         "city_id": SMALLINT(),
         "city_name": VARCHAR(50),
+        "center_latitude": FLOAT(),
+        "center_longitude": FLOAT(),
     }
 
     city_df.to_sql(
@@ -68,21 +107,18 @@ def city_table():
         method="multi",
         dtype=dtype_dict,
     )
-    session.execute(
-        text(
-            """
-        ALTER TABLE silver.city
-        ADD CONSTRAINT pk_city PRIMARY KEY (city_id);
-    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+            ALTER TABLE silver.city
+            ADD CONSTRAINT pk_city PRIMARY KEY (city_id);
+        """
+            )
         )
-    )
-    session.commit()
     print("Unique cities inserted into the database successfully!")
 
 
-city_table()
-
-
 def property_table():
     property_df = pd.DataFrame(df["property_type"].unique(), columns=["property_type"])
 
@@ -101,21 +137,18 @@ def property_table():
         method="multi",
         dtype=dtype_dict,
     )
-    session.execute(
-        text(
-            """
-        ALTER TABLE silver.property_types
-        ADD CONSTRAINT pk_property_type PRIMARY KEY (property_id);
-    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+            ALTER TABLE silver.property_types
+            ADD CONSTRAINT pk_property_type PRIMARY KEY (property_id);
+        """
+            )
         )
-    )
-    session.commit()
     print("Unique properties inserted into the database successfully!")
 
 
-property_table()
-
-
 def room_type_table():
     room_type_df = pd.DataFrame(df["room_type"].unique(), columns=["room_type"])
 
@@ -134,25 +167,18 @@ def room_type_table():
         method="multi",
         dtype=dtype_dict,
     )
-    session.execute(
-        text(
-            """
-        ALTER TABLE silver.room_types
-        ADD CONSTRAINT pk_room_type PRIMARY KEY (room_type_id);
-    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+            ALTER TABLE silver.room_types
+            ADD CONSTRAINT pk_room_type PRIMARY KEY (room_type_id);
+        """
+            )
         )
-    )
-    session.commit()
     print("Unique room types inserted into the database successfully!")
 
 
-room_type_table()
-
-
-def convert_to_geojson(geometry):
-    return geometry.__geo_interface__
-
-
 def neighbourhoods_table():
     neighbourhood_df = clean_json()
     city_df = pd.read_sql("SELECT * FROM silver.city", engine)
@@ -164,18 +190,13 @@ def neighbourhoods_table():
         how="left",
     ).drop(columns="city")
 
-    neighbourhood_df["geometry"] = neighbourhood_df["geometry"].apply(
-        lambda geom: convert_to_geojson(geom)
-    )
-    neighbourhood_df["geometry"] = neighbourhood_df["geometry"].apply(
-        lambda geom: json.dumps(geom)
-    )
+    neighbourhood_df = pd.DataFrame(neighbourhood_df.to_wkt())
 
     dtype_dict = {
         "neighbourhood_id": INTEGER(),
         "neighbourhood": VARCHAR(100),
         "neighbourhood_group": VARCHAR(100),
-        "geometry": JSONB(),
+        "geometry": VARCHAR(),
         "city_id": SMALLINT(),
     }
 
@@ -189,19 +210,36 @@ def neighbourhoods_table():
         dtype=dtype_dict,
     )
 
-    session.execute(
-        text(
-            """
-    ALTER TABLE silver.neighbourhoods
-    ADD CONSTRAINT pk_neighbourhood PRIMARY KEY (neighbourhood_id),
-    ADD CONSTRAINT fk_city FOREIGN KEY (city_id) REFERENCES silver.city (city_id)
-    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+        CREATE EXTENSION IF NOT EXISTS postgis;
+
+        ALTER TABLE silver.neighbourhoods
+        ALTER COLUMN geometry TYPE geometry(MultiPolygon, 4326)
+            USING ST_Multi(ST_GeomFromText(geometry, 4326));
+
+        ALTER TABLE silver.neighbourhoods
+        ADD COLUMN centroid geometry(Point, 4326)
+            GENERATED ALWAYS AS (ST_Centroid(geometry)) STORED,
+        ADD COLUMN centroid_latitude FLOAT
+            GENERATED ALWAYS AS (ST_Y(ST_Centroid(geometry))) STORED,
+        ADD COLUMN centroid_longitude FLOAT
+            GENERATED ALWAYS AS (ST_X(ST_Centroid(geometry))) STORED,
+        ADD COLUMN min_latitude FLOAT GENERATED ALWAYS AS (ST_YMin(geometry)) STORED,
+        ADD COLUMN min_longitude FLOAT GENERATED ALWAYS AS (ST_XMin(geometry)) STORED,
+        ADD COLUMN max_latitude FLOAT GENERATED ALWAYS AS (ST_YMax(geometry)) STORED,
+        ADD COLUMN max_longitude FLOAT GENERATED ALWAYS AS (ST_XMax(geometry)) STORED;
+
+        CREATE INDEX idx_neighbourhoods_geometry ON silver.neighbourhoods USING GIST (geometry);
+
+        ALTER TABLE silver.neighbourhoods
+        ADD CONSTRAINT pk_neighbourhood PRIMARY KEY (neighbourhood_id),
+        ADD CONSTRAINT fk_city FOREIGN KEY (city_id) REFERENCES silver.city (city_id)
+        """
+            )
         )
-    )
-    session.commit()
-
-
-neighbourhoods_table()
 
 
 def date_table():
@@ -227,34 +265,280 @@ def date_table():
         method="multi",
         dtype=dtype_dict,
     )
-    session.execute(
-        text("ALTER TABLE silver.dates ADD CONSTRAINT pk_dates PRIMARY KEY (date_id);")
-    )
-    session.commit()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "ALTER TABLE silver.dates ADD CONSTRAINT pk_dates PRIMARY KEY (date_id);"
+            )
+        )
     print("Unique dates inserted into the database successfully!")
 
 
-date_table()
+texts_dtype_dict = {
+    "text_hash": UUID(as_uuid=False),
+    "content": VARCHAR(),
+}
+
+listing_amenities_dtype_dict = {
+    "listing_id": BIGINT(),
+    "date_id": SMALLINT(),
+    "amenity_id": INTEGER(),
+}
+
+host_details_dtype_dict = {
+    "host_id": BIGINT(),
+    "host_name": TEXT(),
+    "host_since": TIMESTAMP(),
+}
+
+host_activity_dtype_dict = {
+    "host_id": BIGINT(),
+    "date_id": BIGINT(),
+    "listing_id": BIGINT(),
+    "host_about_hash": UUID(as_uuid=False),
+    "host_picture_url": TEXT(),
+    "host_is_superhost": TEXT(),
+    "host_identity_verified": TEXT(),
+    "host_response_time": TEXT(),
+}
+
+listings_dtype_dict = {
+    "id": BIGINT(),
+    "name_hash": UUID(as_uuid=False),
+    "description_hash": UUID(as_uuid=False),
+    "listing_url_hash": UUID(as_uuid=False),
+    "picture_url_hash": UUID(as_uuid=False),
+    "latitude": FLOAT(),
+    "longitude": FLOAT(),
+    "accommodates": INTEGER(),
+    "bedrooms": INTEGER(),
+    "bathrooms": INTEGER(),
+    "minimum_nights": SMALLINT(),
+    "maximum_nights": INTEGER(),
+    "season": VARCHAR(),
+    "review_missing": SMALLINT(),
+    "review_scores_rating": FLOAT(),
+    "host_id": INTEGER(),
+    "price_float": FLOAT(),
+    "property_id": INTEGER(),
+    "room_type_id": SMALLINT(),
+    "city_id": SMALLINT(),
+    "neighbourhood_id": SMALLINT(),
+    "date_id": SMALLINT(),
+}
+
+
+def write_jdbc(spark_df, table, dtype_dict):
+    """
+    Create silver.<table> from dtype_dict and let every Spark partition append its
+    rows with JDBC batch inserts, SILVER_WRITE_PARTITIONS of them at a time.
+    """
+    pd.DataFrame(columns=list(dtype_dict)).to_sql(
+        table,
+        engine,
+        schema="silver",
+        if_exists="fail",
+        index=False,
+        dtype=dtype_dict,
+    )
+    (
+        spark_df.select(list(dtype_dict))
+        .repartition(write_partitions)
+        .write.format("jdbc")
+        .options(**get_jdbc_options())
+        .option("dbtable", f"silver.{table}")
+        .option("batchsize", 20000)
+        .option("numPartitions", write_partitions)
+        .mode("append")
+        .save()
+    )
 
 
-def host_table():
+def spark_dimension(query):
+    """Read a small silver table into a Spark DataFrame to broadcast in joins"""
+    return F.broadcast(spark.createDataFrame(pd.read_sql(query, engine)))
+
+
+def texts_constraints():
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "ALTER TABLE silver.texts ADD CONSTRAINT pk_texts PRIMARY KEY (text_hash);"
+            )
+        )
+    print("Unique texts inserted into the database successfully!")
+
+
+def texts_table():
+    texts_df = pd.concat(
+        [
+            df[[f"{column}_hash", column]].set_axis(["text_hash", "content"], axis=1)
+            for column in text_columns
+        ]
+    )
+    texts_df = texts_df.dropna(subset=["text_hash"]).drop_duplicates(subset="text_hash")
+
+    texts_df.to_sql(
+        "texts",
+        engine,
+        schema="silver",
+        if_exists="fail",
+        index=False,
+        method="multi",
+        chunksize=20000,
+        dtype=texts_dtype_dict,
+    )
+    texts_constraints()
+
+
+def texts_table_spark():
+    texts_df = reduce(
+        DataFrame.unionByName,
+        [
+            spark_df.select(
+                F.col(f"{column}_hash").alias("text_hash"),
+                F.col(column).alias("content"),
+            )
+            for column in text_columns
+        ],
+    )
+    texts_df = texts_df.dropna(subset=["text_hash"]).dropDuplicates(["text_hash"])
+
+    write_jdbc(texts_df, "texts", texts_dtype_dict)
+    texts_constraints()
+
+
+def amenities_table():
+    amenity_df = (
+        amenities_df[["amenity", "category"]]
+        .drop_duplicates(subset="amenity")
+        .sort_values(["category", "amenity"])
+        .reset_index(drop=True)
+    )
+
+    dtype_dict = {
+        "amenity_id": INTEGER(),
+        "amenity": VARCHAR(),
+        "category": VARCHAR(50),
+    }
+
+    amenity_df.to_sql(
+        "amenities",
+        engine,
+        schema="silver",
+        if_exists="fail",
+        index=True,
+        index_label="amenity_id",
+        method="multi",
+        dtype=dtype_dict,
+    )
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+            ALTER TABLE silver.amenities
+            ADD CONSTRAINT pk_amenities PRIMARY KEY (amenity_id);
+            CREATE INDEX idx_amenities_category ON silver.amenities (category);
+        """
+            )
+        )
+    print("Unique amenities inserted into the database successfully!")
+
+
+def listing_amenities_constraints():
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE INDEX idx_listing_amenities_amenity_id ON silver.listing_amenities (amenity_id, listing_id);
+
+                ALTER TABLE silver.listing_amenities
+                ADD CONSTRAINT pk_listing_amenities PRIMARY KEY (listing_id, date_id, amenity_id),
+                ADD CONSTRAINT fk_listing_amenities_date FOREIGN KEY (date_id) REFERENCES silver.dates(date_id),
+                ADD CONSTRAINT fk_listing_amenities_amenity FOREIGN KEY (amenity_id) REFERENCES silver.amenities(amenity_id);
+                """
+            )
+        )
+    print("Listing amenities inserted into the database successfully!")
+
+
+def listing_amenities_table():
+    amenity_df = pd.read_sql("SELECT amenity_id, amenity FROM silver.amenities", engine)
     date_df = pd.read_sql("SELECT * FROM silver.dates", engine)
-    host_df = pd.DataFrame(
-        df[
-            [
-                "host_id",
-                "host_name",
-                "host_since",
-                "host_about",
-                "host_picture_url",
-                "host_response_time",
-                "host_is_superhost",
-                "host_identity_verified",
-                "date",
-                "id",
-            ]
-        ].drop_duplicates()
+
+    listing_amenities_df = amenities_df.merge(amenity_df, on="amenity", how="inner")
+    listing_amenities_df = listing_amenities_df.merge(date_df, on="date", how="inner")
+    listing_amenities_df = listing_amenities_df[["id", "date_id", "amenity_id"]].rename(
+        columns={"id": "listing_id"}
+    )
+
+    listing_amenities_df.to_sql(
+        "listing_amenities",
+        engine,
+        schema="silver",
+        if_exists="fail",
+        index=False,
+        method="multi",
+        chunksize=20000,
+        dtype=listing_amenities_dtype_dict,
     )
+    listing_amenities_constraints()
+
+
+def listing_amenities_table_spark():
+    amenity_df = spark_dimension("SELECT amenity_id, amenity FROM silver.amenities")
+    date_df = spark_dimension("SELECT * FROM silver.dates")
+
+    listing_amenities_df = (
+        spark_amenities_df.join(amenity_df, on="amenity", how="inner")
+        .join(date_df, on="date", how="inner")
+        .withColumnRenamed("id", "listing_id")
+    )
+
+    write_jdbc(listing_amenities_df, "listing_amenities", listing_amenities_dtype_dict)
+    listing_amenities_constraints()
+
+
+def host_constraints():
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE INDEX idx_host_activity_host_id ON silver.host_activity (host_id);
+                CREATE INDEX idx_host_activity_date_id ON silver.host_activity (date_id);
+                CREATE INDEX idx_host_activity_listing_id ON silver.host_activity (listing_id);
+
+                ALTER TABLE silver.host_details
+                ADD CONSTRAINT pk_host_details PRIMARY KEY (host_id);
+
+                ALTER TABLE silver.host_activity
+                ADD CONSTRAINT fk_host_details FOREIGN KEY (host_id) REFERENCES silver.host_details(host_id),
+                ADD CONSTRAINT fk_host_date FOREIGN KEY (date_id) REFERENCES silver.dates(date_id),
+                ADD CONSTRAINT fk_host_about FOREIGN KEY (host_about_hash) REFERENCES silver.texts(text_hash);
+                """
+            )
+        )
+
+    print("Host tables created successfully!")
+
+
+host_columns = [
+    "host_id",
+    "host_name",
+    "host_since",
+    "host_about_hash",
+    "host_picture_url",
+    "host_response_time",
+    "host_is_superhost",
+    "host_identity_verified",
+    "date",
+    "id",
+]
+
+
+def host_table():
+    date_df = pd.read_sql("SELECT * FROM silver.dates", engine)
+    host_df = pd.DataFrame(df[host_columns].drop_duplicates())
     host_df = pd.merge(host_df, date_df, left_on="date", right_on="date", how="left")
     host_df = host_df.drop(columns="date")
     host_df["host_since"] = pd.to_datetime(host_df["host_since"])
@@ -262,18 +546,9 @@ def host_table():
     host_details_df = host_df[["host_id", "host_name", "host_since"]].drop_duplicates(
         subset=["host_id"]
     )
-    host_activity_df = host_df[
-        [
-            "host_id",
-            "date_id",
-            "id",
-            "host_about",
-            "host_picture_url",
-            "host_is_superhost",
-            "host_identity_verified",
-            "host_response_time",
-        ]
-    ].rename(columns={"id": "listing_id"})
+    host_activity_df = host_df.rename(columns={"id": "listing_id"})[
+        list(host_activity_dtype_dict)
+    ]
 
     host_details_df.to_sql(
         "host_details",
@@ -282,6 +557,7 @@ def host_table():
         index=False,
         if_exists="replace",
         method="multi",
+        dtype=host_details_dtype_dict,
     )
 
     host_activity_df.to_sql(
@@ -292,30 +568,78 @@ def host_table():
         if_exists="replace",
         method="multi",
         chunksize=20000,
+        dtype=host_activity_dtype_dict,
     )
+    host_constraints()
 
-    session.execute(
-        text(
-            """
-            CREATE INDEX idx_host_activity_host_id ON silver.host_activity (host_id);
-            CREATE INDEX idx_host_activity_date_id ON silver.host_activity (date_id);
-            CREATE INDEX idx_host_activity_listing_id ON silver.host_activity (listing_id);
 
-            ALTER TABLE silver.host_details
-            ADD CONSTRAINT pk_host_details PRIMARY KEY (host_id);
+def host_table_spark():
+    date_df = spark_dimension("SELECT * FROM silver.dates")
+    host_df = (
+        spark_df.select(host_columns)
+        .dropDuplicates()
+        .join(date_df, on="date", how="left")
+        .drop("date")
+        .withColumn("host_since", F.col("host_since").cast("timestamp"))
+    )
 
-            ALTER TABLE silver.host_activity
-            ADD CONSTRAINT fk_host_details FOREIGN KEY (host_id) REFERENCES silver.host_details(host_id),
-            ADD CONSTRAINT fk_host_date FOREIGN KEY (date_id) REFERENCES silver.dates(date_id);
-            """
-        )
+    write_jdbc(
+        host_df.dropDuplicates(["host_id"]), "host_details", host_details_dtype_dict
+    )
+    write_jdbc(
+        host_df.withColumnRenamed("id", "listing_id"),
+        "host_activity",
+        host_activity_dtype_dict,
     )
-    session.commit()
+    host_constraints()
 
-    print("Host tables created successfully!")
 
+def read_neighbourhood_polygons():
+    neighbourhood_df = pd.read_sql(
+        """
+        SELECT neighbourhood_id, ST_AsBinary(geometry) AS geometry
+        FROM silver.neighbourhoods
+        """,
+        engine,
+    )
+    neighbourhood_df["geometry"] = shapely.from_wkb(
+        neighbourhood_df["geometry"].apply(bytes).to_numpy()
+    )
+    return neighbourhood_df
+
+
+def listings_constraints():
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE INDEX idx_listings_host_id ON silver.listings (host_id);
+                CREATE INDEX idx_listings_date_id ON silver.listings (date_id);
+                CREATE INDEX idx_listings_id ON silver.listings (id);
+                """
+            )
+        )
 
-host_table()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                ALTER TABLE silver.listings
+                ADD CONSTRAINT pk_listings PRIMARY KEY (id, date_id),
+                ADD CONSTRAINT fk_listings_property FOREIGN KEY (property_id) REFERENCES silver.property_types(property_id),
+                ADD CONSTRAINT fk_listings_room_type FOREIGN KEY (room_type_id) REFERENCES silver.room_types(room_type_id),
+                ADD CONSTRAINT fk_listings_city FOREIGN KEY (city_id) REFERENCES silver.city(city_id),
+                ADD CONSTRAINT fk_listings_neighbourhood FOREIGN KEY (neighbourhood_id) REFERENCES silver.neighbourhoods(neighbourhood_id),
+                ADD CONSTRAINT fk_listings_date FOREIGN KEY (date_id) REFERENCES silver.dates(date_id),
+                ADD CONSTRAINT fk_listings_name FOREIGN KEY (name_hash) REFERENCES silver.texts(text_hash),
+                ADD CONSTRAINT fk_listings_description FOREIGN KEY (description_hash) REFERENCES silver.texts(text_hash),
+                ADD CONSTRAINT fk_listings_listing_url FOREIGN KEY (listing_url_hash) REFERENCES silver.texts(text_hash),
+                ADD CONSTRAINT fk_listings_picture_url FOREIGN KEY (picture_url_hash) REFERENCES silver.texts(text_hash);
+                """
+            )
+        )
+
+    print("Listings table created successfully!")
 
 
 def listings_table():
@@ -323,10 +647,10 @@ def listings_table():
         df[
             [
                 "id",
-                "name",
-                "description",
-                "listing_url",
-                "picture_url",
+                "name_hash",
+                "description_hash",
+                "listing_url_hash",
+                "picture_url_hash",
                 "latitude",
                 "longitude",
                 "property_type",
@@ -341,7 +665,6 @@ def listings_table():
                 "season",
                 "review_missing",
                 "review_scores_rating",
-                "categorized_amenities",
                 "host_id",
                 "date",
                 "price_float",
@@ -351,7 +674,7 @@ def listings_table():
     property_df = pd.read_sql("SELECT * FROM silver.property_types", engine)
     room_type_df = pd.read_sql("SELECT * FROM silver.room_types", engine)
     city_df = pd.read_sql("SELECT * FROM silver.city", engine)
-    neighbourhood_df = pd.read_sql("SELECT * FROM silver.neighbourhoods", engine)
+    neighbourhood_df = read_neighbourhood_polygons()
     date_df = pd.read_sql("SELECT * FROM silver.dates", engine)
 
     listings_df = pd.merge(listings_df, property_df, on="property_type", how="left")
@@ -363,55 +686,17 @@ def listings_table():
         right_on="city_name",
         how="left",
     )
-    listings_df = pd.merge(
-        listings_df,
-        neighbourhood_df[["neighbourhood_id", "neighbourhood", "city_id"]],
-        on=["neighbourhood", "city_id"],
-        how="left",
+    listings_df["neighbourhood_id"] = assign_neighbourhoods(
+        listings_df, neighbourhood_df
     )
-    listings_df = listings_df[~pd.isnull(listings_df["neighbourhood_id"])]
+    unplaced = pd.isnull(listings_df["neighbourhood_id"])
+    for city, count in listings_df[unplaced].groupby("city").size().items():
+        print(f"{count} {city} listings outside every neighbourhood dropped")
+    listings_df = listings_df[~unplaced]
     listings_df["neighbourhood_id"] = listings_df["neighbourhood_id"].astype("int")
     listings_df = pd.merge(listings_df, date_df, on="date", how="left")
 
-    listings_df["categorized_amenities"] = listings_df["categorized_amenities"].apply(
-        json.dumps
-    )
-    listings_df = listings_df.drop(
-        columns=[
-            "property_type",
-            "room_type",
-            "city",
-            "neighbourhood",
-            "date",
-            "city_name",
-        ]
-    )
-
-    dtype_dict = {
-        "id": BIGINT(),
-        "name": VARCHAR(),
-        "description": VARCHAR(),
-        "listing_url": VARCHAR(),
-        "picture_url": VARCHAR(),
-        "latitude": FLOAT(),
-        "longitude": FLOAT(),
-        "accommodates": INTEGER(),
-        "bedrooms": INTEGER(),
-        "bathrooms": INTEGER(),
-        "minimum_nights": SMALLINT(),
-        "maximum_nights": INTEGER(),
-        "season": VARCHAR(),
-        "review_missing": SMALLINT(),
-        "review_scores_rating": FLOAT(),
-        "categorized_amenities": VARCHAR(),
-        "host_id": INTEGER(),
-        "price_float": FLOAT(),
-        "property_id": INTEGER(),
-        "room_type_id": SMALLINT(),
-        "city_id": SMALLINT(),
-        "neighbourhood_id": SMALLINT(),
-        "date_id": SMALLINT(),
-    }
+    listings_df = listings_df[list(listings_dtype_dict)]
 
     listings_df.to_sql(
         "listings",
@@ -420,36 +705,98 @@ def listings_table():
         index=False,
         method="multi",
         chunksize=20000,
-        dtype=dtype_dict,
+        dtype=listings_dtype_dict,
+    )
+    listings_constraints()
+
+
+def listings_table_spark():
+    property_df = spark_dimension("SELECT * FROM silver.property_types")
+    room_type_df = spark_dimension("SELECT * FROM silver.room_types")
+    city_df = spark_dimension("SELECT city_id, city_name AS city FROM silver.city")
+    date_df = spark_dimension("SELECT * FROM silver.dates")
+
+    neighbourhood_df = read_neighbourhood_polygons()
+    polygons = spark.sparkContext.broadcast(
+        (
+            neighbourhood_df["neighbourhood_id"].to_list(),
+            shapely.to_wkb(neighbourhood_df["geometry"].to_numpy()).tolist(),
+        )
     )
 
-    session.execute(
-        text(
-            """
-            CREATE INDEX idx_listings_host_id ON silver.listings (host_id);
-            CREATE INDEX idx_listings_date_id ON silver.listings (date_id);
-            CREATE INDEX idx_listings_id ON silver.listings (id);
-            """
+    def assign_partition(batches):
+        neighbourhood_ids, geometries = polygons.value
+        partition_polygons = pd.DataFrame(
+            {
+                "neighbourhood_id": neighbourhood_ids,
+                "geometry": shapely.from_wkb(geometries),
+            }
         )
+        for batch in batches:
+            batch["neighbourhood_id"] = assign_neighbourhoods(batch, partition_polygons)
+            yield batch
+
+    listings_df = (
+        spark_df.join(property_df, on="property_type", how="left")
+        .join(room_type_df, on="room_type", how="left")
+        .join(city_df, on="city", how="left")
+        .withColumn("neighbourhood_id", F.lit(None).cast("double"))
     )
-    session.commit()
-
-    session.execute(
-        text(
-            """
-            ALTER TABLE silver.listings
-            ADD CONSTRAINT pk_listings PRIMARY KEY (id, date_id),
-            ADD CONSTRAINT fk_listings_property FOREIGN KEY (property_id) REFERENCES silver.property_types(property_id),
-            ADD CONSTRAINT fk_listings_room_type FOREIGN KEY (room_type_id) REFERENCES silver.room_types(room_type_id),
-            ADD CONSTRAINT fk_listings_city FOREIGN KEY (city_id) REFERENCES silver.city(city_id),
-            ADD CONSTRAINT fk_listings_neighbourhood FOREIGN KEY (neighbourhood_id) REFERENCES silver.neighbourhoods(neighbourhood_id),
-            ADD CONSTRAINT fk_listings_date FOREIGN KEY (date_id) REFERENCES silver.dates(date_id);
-            """
+    listings_df = listings_df.mapInPandas(
+        assign_partition, schema=listings_df.schema
+    ).persist()
+    for row in (
+        listings_df.filter(F.col("neighbourhood_id").isNull())
+        .groupBy("city")
+        .count()
+        .collect()
+    ):
+        print(
+            f"{row['count']} {row['city']} listings outside every neighbourhood dropped"
         )
+    listings_df = (
+        listings_df.filter(F.col("neighbourhood_id").isNotNull())
+        .withColumn("neighbourhood_id", F.col("neighbourhood_id").cast("int"))
+        .join(date_df, on="date", how="left")
     )
-    session.commit()
-
-    print("Listings table created successfully!")
 
-
-listings_table()
+    write_jdbc(listings_df, "listings", listings_dtype_dict)
+    listings_constraints()
+
+
+run_tasks(
+    {
+        "calendar": (lambda: insert_calendar_table(calendar_path), []),
+        "city": (city_table, []),
+        "property_types": (property_table, []),
+        "room_types": (room_type_table, []),
+        "dates": (date_table, []),
+        "texts": (texts_table_spark if write_mode == "spark" else texts_table, []),
+        "amenities": (amenities_table, []),
+        "neighbourhoods": (neighbourhoods_table, ["city"]),
+        "listing_amenities": (
+            (
+                listing_amenities_table_spark
+                if write_mode == "spark"
+                else listing_amenities_table
+            ),
+            ["amenities", "dates"],
+        ),
+        "host": (
+            host_table_spark if write_mode == "spark" else host_table,
+            ["dates", "texts"],
+        ),
+        "listings": (
+            listings_table_spark if write_mode == "spark" else listings_table,
+            [
+                "property_types",
+                "room_types",
+                "city",
+                "neighbourhoods",
+                "dates",
+                "texts",
+            ],
+        ),
+    },
+    max_workers=max_workers,
+)
@@ -16,13 +16,21 @@ import sys
 # Add backend folder to the path
 sys.path.append("../../")
 from backend.db_connection import get_sqlalchemy_session
+from data_processing.gold.versions import get_active_version
 
 engine, session = get_sqlalchemy_session()
 
 
 def all_data():
-    query = """
-        SELECT * FROM gold.earnings_summary"""
+    active = get_active_version(engine)
+    schema = active.schema_name if active else "gold"
+    query = f"""
+        SELECT
+            e.*,
+            c.center_latitude AS city_center_lat,
+            c.center_longitude AS city_center_lon
+        FROM {schema}.earnings_summary e
+        LEFT JOIN silver.city c ON e.city_name::text = c.city_name"""
 
     data = pd.read_sql(query, engine)
     columns = [
@@ -41,6 +49,8 @@ def all_data():
         "unavailable_days",
         "available_days",
         "price_float",
+        "city_center_lat",
+        "city_center_lon",
     ]
     df = data[columns]
     return df
@@ -50,21 +60,6 @@ df_predict_price = all_data()
 
 
 def city_center(df):
-    city_centers = {
-        "Barcelona": {"latitude": 41.3851, "longitude": 2.1734},
-        "Euskadi": {"latitude": 42.9896, "longitude": -2.6189},  # Bilbao as the center
-        "Girona": {"latitude": 41.9818, "longitude": 2.8237},
-        "Madrid": {"latitude": 40.4168, "longitude": -3.7038},
-        "Malaga": {"latitude": 36.7213, "longitude": -4.4213},
-        "Mallorca": {"latitude": 39.6953, "longitude": 3.0176},  # Palma as the center
-        "Menorca": {"latitude": 39.8895, "longitude": 4.2642},  # Mahón as the center
-        "Sevilla": {"latitude": 37.3891, "longitude": -5.9845},
-        "Valencia": {"latitude": 39.4699, "longitude": -0.3763},
-    }
-
-    df["city_center_lat"] = df["city_name"].map(lambda x: city_centers[x]["latitude"])
-    df["city_center_lon"] = df["city_name"].map(lambda x: city_centers[x]["longitude"])
-
     df["distance_to_center"] = np.sqrt(
         (df["latitude"] - df["city_center_lat"]) ** 2
         + (df["longitude"] - df["city_center_lon"]) ** 2
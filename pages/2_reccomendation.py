@@ -5,10 +5,13 @@ from backend.queries import (
     get_neighbourhoods,
     get_room_types,
     reccomendation_query,
+    ListingFilters,
     price_ranges,
     get_seasons,
+    get_texts,
+    get_listing_amenities,
+    filter_counts,
 )
-import json
 
 if "selected_city" not in st.session_state:
     st.session_state.selected_city = None
@@ -52,11 +55,34 @@ if selected_city != st.session_state.selected_city:
 neighbourhoods = get_neighbourhoods(selected_city)
 neighbourhood_names = [n[0] for n in neighbourhoods]
 
+
+def selected_filters():
+    """Return the filters picked so far as (dimension, value) pairs for the filter cube."""
+    neighbourhood = st.session_state.get("rec_neighbourhood")
+    return (
+        ("neighbourhood", None if neighbourhood == "All" else neighbourhood),
+        ("room_type", st.session_state.get("rec_room_type")),
+        ("accommodates", st.session_state.get("rec_accommodates", 1)),
+        ("season", st.session_state.get("rec_season")),
+        ("price_range", st.session_state.get("rec_price_range")),
+    )
+
+
+def with_counts(facet):
+    """Label each option of a filter with the listings it leaves given the other filters."""
+    counts = filter_counts(selected_city, selected_filters(), facet)
+    return lambda option: (
+        option if option == "All" else f"{option} ({counts.get(option, 0)})"
+    )
+
+
 selected_neighbourhood = col2.selectbox(
     "Select Neighbourhood",
     placeholder="Choose an Option",
     index=None,
     options=["All"] + neighbourhood_names,
+    format_func=with_counts("neighbourhood"),
+    key="rec_neighbourhood",
 )
 
 st.session_state.selected_neighbourhood = selected_neighbourhood
@@ -67,6 +93,8 @@ selected_season = col3.selectbox(
     placeholder="Choose an Option",
     index=None,
     options=seasons,
+    format_func=with_counts("season"),
+    key="rec_season",
 )
 unique_room_types = get_room_types()
 selected_room_type = col4.selectbox(
@@ -74,9 +102,11 @@ selected_room_type = col4.selectbox(
     placeholder="Choose an Option",
     index=None,
     options=list(unique_room_types),
+    format_func=with_counts("room_type"),
+    key="rec_room_type",
 )
 
-selected_accommodates = col5.number_input("Guests?", 1, 50, 1)
+selected_accommodates = col5.number_input("Guests?", 1, 50, 1, key="rec_accommodates")
 selected_nights = col6.number_input("Nights?", 1, 30, 1)
 
 price_range = price_ranges()
@@ -85,26 +115,23 @@ selected_price_range = col7.selectbox(
     placeholder="Choose an Option",
     index=None,
     options=price_range,
+    format_func=with_counts("price_range"),
+    key="rec_price_range",
 )
 
-where_clauses = []
-if selected_city != "Select a city":
-    where_clauses.append(f"city_name = '{selected_city}'")
-if selected_neighbourhood != "All":
-    where_clauses.append(f"neighbourhood = '{selected_neighbourhood}'")
-if selected_season:
-    where_clauses.append(f"season = '{selected_season}'")
-if selected_room_type != "All":
-    where_clauses.append(f"room_type = '{selected_room_type}'")
-if selected_accommodates:
-    where_clauses.append(f"accommodates = {selected_accommodates}")
-if selected_nights:
-    where_clauses.append(f"{selected_nights} BETWEEN minimum_nights AND maximum_nights")
-if selected_price_range:
-    where_clauses.append(f"price_range = '{selected_price_range}'")
-
-
-where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
+filters = ListingFilters(
+    city_name=selected_city if selected_city != "Select a city" else None,
+    neighbourhood=selected_neighbourhood,
+    room_type=selected_room_type,
+    accommodates=selected_accommodates or None,
+    nights=selected_nights or None,
+    season=selected_season,
+    price_range=selected_price_range,
+)
+
+matches = filter_counts(selected_city, selected_filters())
+if matches is not None:
+    st.caption(f"Up to {matches} listings match your filters")
 
 reccomendation_df = None
 if "rec_df" not in st.session_state:
@@ -114,9 +141,9 @@ if "index" not in st.session_state:
 
 with col8:
     st.write("")
-    if st.button("Search"):
+    if st.button("Search", disabled=matches == 0):
 
-        st.session_state.rec_df = reccomendation_query(where_clause)
+        st.session_state.rec_df = reccomendation_query(filters)
         st.session_state.index = 0
         for col in st.session_state.rec_df.select_dtypes(include=["object"]).columns:
             st.session_state.rec_df[col] = st.session_state.rec_df[col].astype(str)
@@ -162,22 +189,28 @@ if st.session_state.rec_df is not None:
     service_fee_amount = base_price * 0.15
     total_price = base_price + service_fee_amount
 
-    try:
-        amenities_str = current_listing["categorized_amenities"].replace("'", '"')
-        amenities_dict = json.loads(amenities_str)
-    except json.JSONDecodeError as e:
-        st.error(f"Failed to parse amenities: {e}")
-        amenities_dict = {}
+    amenities_dict = get_listing_amenities(int(current_listing["id"]))
+
+    texts = get_texts(
+        (
+            current_listing["name_hash"],
+            current_listing["description_hash"],
+            current_listing["picture_url_hash"],
+            current_listing["host_about_hash"],
+        )
+    )
 
     latitude = current_listing["latitude"]
     longitude = current_listing["longitude"]
 
     location_data = pd.DataFrame({"lat": [latitude], "lon": [longitude]})
 
-    st.subheader(current_listing["name"])
+    st.subheader(texts.get(current_listing["name_hash"], ""))
     photo, map = st.columns([2, 3])
     with photo:
-        st.image(current_listing["picture_url"], use_container_width=True)
+        st.image(
+            texts.get(current_listing["picture_url_hash"]), use_container_width=True
+        )
     with map:
         st.map(location_data, zoom=13, size=(100, 100), use_container_width=True)
     st.markdown("### 🏡 Property Details")
@@ -206,10 +239,10 @@ if st.session_state.rec_df is not None:
                 unsafe_allow_html=True,
             )
     l.write(f"**Hosted by:** {current_listing['host_name']}")
-    l.write(f"📝 {current_listing['host_about']}")
+    l.write(f"📝 {texts.get(current_listing['host_about_hash'], '')}")
 
     l.markdown("### 📌 Description")
-    l.write(current_listing["description"])
+    l.write(texts.get(current_listing["description_hash"], ""))
 
     l.markdown("### 🏠 Amenities")
 
@@ -7,6 +7,7 @@ from backend.queries import (
     get_room_types,
     get_loc,
     neigh_price_query,
+    neighbourhood_trends_query,
 )
 import os
 import plotly.graph_objects as go
@@ -20,19 +21,6 @@ if "neighborhoods" not in st.session_state:
 if "selected_neighbourhood" not in st.session_state:
     st.session_state.selected_neighbourhood = "All"
 
-# City centers
-city_centers = {
-    "Barcelona": {"latitude": 41.3851, "longitude": 2.1734},
-    "Euskadi": {"latitude": 42.9896, "longitude": -2.6189},
-    "Girona": {"latitude": 41.9818, "longitude": 2.8237},
-    "Madrid": {"latitude": 40.4168, "longitude": -3.7038},
-    "Malaga": {"latitude": 36.7213, "longitude": -4.4213},
-    "Mallorca": {"latitude": 39.6953, "longitude": 3.0176},
-    "Menorca": {"latitude": 39.8895, "longitude": 4.2642},
-    "Sevilla": {"latitude": 37.3891, "longitude": -5.9845},
-    "Valencia": {"latitude": 39.4699, "longitude": -0.3763},
-}
-
 st.title("Host Earnings Dashboard")
 
 st.write("")
@@ -102,7 +90,6 @@ if col7.button("Search"):
         latitude, longitude, distance = get_loc(
             st.session_state.selected_city,
             st.session_state.selected_neighbourhood,
-            city_centers,
         )
 
         input_data = pd.DataFrame(
@@ -300,7 +287,12 @@ if input_data is not None:
 
     fig2.add_trace(
         go.Box(
-            y=data["price_float"],
+            q1=[data["q1"]],
+            median=[data["median"]],
+            q3=[data["q3"]],
+            lowerfence=[data["lower_fence"]],
+            upperfence=[data["upper_fence"]],
+            mean=[data["mean_price"]],
             name="Neighborhood Price Range",
             marker_color="#003049",
         )
@@ -329,5 +321,34 @@ if input_data is not None:
     )
 
     tres.plotly_chart(fig2, use_container_width=True, height=500)
+
+    trends_df = neighbourhood_trends_query(selected_neighbourhood_id)
+    if not trends_df.empty:
+        trends_chart = (
+            alt.Chart(trends_df)
+            .mark_line(interpolate="monotone", point=True)
+            .encode(
+                x=alt.X(
+                    "quarter:N",
+                    sort=alt.SortField("date_id"),
+                    axis=alt.Axis(title=None, labelAngle=0),
+                ),
+                y=alt.Y("median_price:Q", axis=alt.Axis(title="Median Price ($)")),
+                color=alt.Color(
+                    "room_type:N", legend=alt.Legend(orient="top", title=None)
+                ),
+                tooltip=[
+                    "room_type",
+                    "quarter",
+                    alt.Tooltip("median_price:Q", format=".2f"),
+                    alt.Tooltip("median_price_pct_change:Q", format="+.1%"),
+                    "listings",
+                    alt.Tooltip("avg_rating:Q", format=".2f"),
+                    alt.Tooltip("occupancy_rate:Q", format=".1%"),
+                ],
+            )
+            .properties(height=350, title="Neighborhood Price Trend by Quarter")
+        )
+        st.altair_chart(trends_chart, use_container_width=True)
 else:
     st.warning("Select your filters and click on Search to see the results")
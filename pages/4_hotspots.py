@@ -2,9 +2,6 @@ import streamlit as st
 import pandas as pd
 import geopandas as gpd
 import folium
-import json
-from shapely.ops import transform
-import pyproj
 from streamlit.components.v1 import html
 from folium.plugins import MarkerCluster
 import warnings
@@ -13,7 +10,10 @@ from backend.queries import (
     get_cities,
     get_neighbourhoods,
     data_query,
+    ListingFilters,
     geometry_query,
+    get_map_center,
+    filter_counts,
 )
 
 warnings.filterwarnings("ignore", category=FutureWarning, message=".*pyproj.*")
@@ -73,32 +73,37 @@ selected_neighbourhood = col5.selectbox(
     "Select Neighbourhood", index=0, options=["All"] + neighbourhood_names
 )
 
-where_clauses = []
-if selected_city != "Select a city":
-    where_clauses.append(f"city_name = '{selected_city}'")
-if selected_room_type != "All":
-    where_clauses.append(f"room_type = '{selected_room_type}'")
-if selected_accommodates:
-    where_clauses.append(f"accommodates = {selected_accommodates}")
-if selected_days:
-    where_clauses.append(f"{selected_days} BETWEEN minimum_nights AND maximum_nights")
-if selected_neighbourhood != "All":
-    where_clauses.append(f"neighbourhood = '{selected_neighbourhood}'")
-
-where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
-
-
-def simplify_geometry(geometry, tolerance=0.01):
-    """Simplify geometry to reduce size."""
-    project = pyproj.Transformer.from_proj(
-        pyproj.Proj(init="epsg:4326"),
-        pyproj.Proj(init="epsg:3857"),
-    )
-    geometry_transformed = transform(project.transform, geometry)
-    simplified = geometry_transformed.simplify(tolerance, preserve_topology=True)
-    return transform(
-        lambda x, y, z=None: project.transform(x, y, direction="INVERSE"), simplified
-    )
+filters = ListingFilters(
+    city_name=selected_city if selected_city != "Select a city" else None,
+    neighbourhood=selected_neighbourhood,
+    room_type=selected_room_type,
+    accommodates=selected_accommodates or None,
+    nights=selected_days or None,
+)
+
+matches = filter_counts(
+    selected_city,
+    (
+        (
+            "neighbourhood",
+            None if selected_neighbourhood == "All" else selected_neighbourhood,
+        ),
+        ("room_type", None if selected_room_type == "All" else selected_room_type),
+        ("accommodates", selected_accommodates),
+    ),
+    count="listings",
+    cube="listings_cube",
+)
+if matches is not None:
+    st.caption(f"Up to {matches} listings match your filters")
+
+
+seasonal_price_columns = {
+    "Early Spring": "price_early_spring",
+    "Early Summer": "price_early_summer",
+    "Early Autumn": "price_early_autumn",
+    "Early Winter": "price_early_winter",
+}
 
 
 def price_color_function(price):
@@ -124,10 +129,8 @@ if "listings_df" not in st.session_state:
 
 with col6:
     st.write("")
-    if st.button("Search"):
-        geometry_df = geometry_query()
-
-        st.session_state.listings_df = data_query(where_clause)
+    if st.button("Search", disabled=matches == 0):
+        st.session_state.listings_df = data_query(filters)
 
 listings_df = st.session_state.listings_df
 
@@ -136,13 +139,12 @@ if listings_df is not None and not listings_df.empty:
         listings_df = listings_df.sample(frac=0.6, random_state=17)
     else:
         listings_df = listings_df.sample(frac=0.9, random_state=17)
-        
+
     if listings_df.empty:
         st.warning("No listings found for the selected filters.")
         st.stop()
 
-    geometry_df["geometry"] = geometry_df["geometry"].apply(simplify_geometry)
-
+    geometry_df = geometry_query(selected_city)
     geometry_df = gpd.GeoDataFrame(geometry_df, geometry="geometry", crs="EPSG:4326")
 
     neighborhood_stats = (
@@ -151,8 +153,14 @@ if listings_df is not None and not listings_df.empty:
     df = pd.merge(geometry_df, neighborhood_stats, on="neighbourhood_id", how="left")
 
     def create_map():
-        map_center = [listings_df["latitude"].mean(), listings_df["longitude"].mean()]
+        map_center = get_map_center(
+            selected_city,
+            None if selected_neighbourhood == "All" else selected_neighbourhood,
+        )
         m = folium.Map(location=map_center, zoom_start=12, control_scale=True)
+        if map_center is None and not df.empty:
+            min_lon, min_lat, max_lon, max_lat = df.total_bounds
+            m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
 
         folium.GeoJson(
             df,
@@ -176,24 +184,19 @@ if listings_df is not None and not listings_df.empty:
         listings_df["total_price"] = listings_df["price_float"] * selected_days
         listings_df["total_price"] = listings_df["total_price"].round(2)
 
-        def format_seasonal_prices(seasonal_prices_json):
-            if pd.isna(seasonal_prices_json):
+        def format_seasonal_prices(row):
+            prices = [
+                f"{season}: ${row[column]:.2f}"
+                for season, column in seasonal_price_columns.items()
+                if pd.notna(row[column])
+            ]
+            if not prices:
                 return "No seasonal pricing data available."
 
-            try:
-                seasonal_prices = json.loads(seasonal_prices_json)
-                formatted_prices = "<br>".join(
-                    [
-                        f"{season}: ${price:.2f}"
-                        for season, price in seasonal_prices.items()
-                    ]
-                )
-                return f"<b>Seasonal Prices:</b><br>{formatted_prices}"
-            except json.JSONDecodeError:
-                return "Invalid seasonal pricing data."
+            return f"<b>Seasonal Prices:</b><br>{'<br>'.join(prices)}"
 
         for _, row in listings_df.iterrows():
-            seasonal_prices_html = format_seasonal_prices(row["seasonal_prices"])
+            seasonal_prices_html = format_seasonal_prices(row)
             popup_html = f"""
                 <div style='width: 200px;'>
                     <h4>{row['neighbourhood']}</h4>
@@ -207,7 +210,7 @@ if listings_df is not None and not listings_df.empty:
                     <a href='{row['listing_url']}' target="_blank">View Listing</a>
                 </div>
             """
-            
+
             folium.Marker(
                 location=[row["latitude"], row["longitude"]],
                 icon=folium.Icon(color="blue"),
@@ -0,0 +1,37 @@
+import pytest
+
+from data_processing.scheduler import run_tasks
+
+
+def test_failed_task_cancels_queued_tasks():
+    ran = []
+
+    def fail():
+        raise RuntimeError("load failed")
+
+    tasks = {
+        "fail": (fail, []),
+        "sibling": (lambda: ran.append("sibling"), []),
+        "dependent": (lambda: ran.append("dependent"), ["fail"]),
+    }
+    with pytest.raises(RuntimeError, match="load failed"):
+        run_tasks(tasks, max_workers=1)
+
+    assert ran == []
+
+
+def test_dependencies_run_first():
+    ran = []
+    tasks = {
+        "gold": (lambda: ran.append("gold"), ["silver"]),
+        "silver": (lambda: ran.append("silver"), []),
+    }
+    run_tasks(tasks, max_workers=2)
+
+    assert ran == ["silver", "gold"]
+
+
+def test_circular_dependencies_raise():
+    tasks = {"a": (lambda: None, ["b"]), "b": (lambda: None, ["a"])}
+    with pytest.raises(ValueError, match="Circular"):
+        run_tasks(tasks)
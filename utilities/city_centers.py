@@ -0,0 +1,11 @@
+city_centers = {
+    "Barcelona": {"latitude": 41.3851, "longitude": 2.1734},
+    "Euskadi": {"latitude": 42.9896, "longitude": -2.6189},  # Bilbao as the center
+    "Girona": {"latitude": 41.9818, "longitude": 2.8237},
+    "Madrid": {"latitude": 40.4168, "longitude": -3.7038},
+    "Malaga": {"latitude": 36.7213, "longitude": -4.4213},
+    "Mallorca": {"latitude": 39.6953, "longitude": 3.0176},  # Palma as the center
+    "Menorca": {"latitude": 39.8895, "longitude": 4.2642},  # Mahón as the center
+    "Sevilla": {"latitude": 37.3891, "longitude": -5.9845},
+    "Valencia": {"latitude": 39.4699, "longitude": -0.3763},
+}